@@ -9,8 +9,10 @@ import utils
 import os
 import perceptron_sketch as perc
 import feature_vector
+import feature_space
 import cPickle
 import json
+from scipy.sparse import vstack
 
 
 #for classification of error types:
@@ -27,8 +29,9 @@ if not os.path.exists(test_files_output_dir):
 
     
 evaluate_test_list = test_files_list
-FV_arg = feature_vector.FeatureVector('argument')
-FV_trig =  feature_vector.FeatureVector('trigger')
+space = feature_space.load_feature_space()
+FV_arg = feature_vector.FeatureVector('argument', space)
+FV_trig =  feature_vector.FeatureVector('trigger', space)
 
 #load weights of pretrained perceptron. 
 with open('Perceptron_trigger.data', 'rb') as f:
@@ -41,8 +44,11 @@ for i_f,test_file in enumerate(evaluate_test_list):
     print 'Test File', i_f, 'of' , len(evaluate_test_list)
     
     #generate predictions for current file, p_e and p_a are the predicted values.
-    (p_e, g_e) = perc.test_perceptron(FV_trig, Lambda_e, [test_file], mode='Trigger')
-    (p_a, g_a) = perc.test_perceptron(FV_arg, Lambda_a, [test_file], mode='Argument')
+    #All candidates of the file are scored in one product per mode.
+    X_e, _ = perc.build_data(FV_trig, [test_file], mode='Trigger')
+    X_a, _ = perc.build_data(FV_arg, [test_file], mode='Argument')
+    p_e = perc.predict_batch(vstack(X_e, format='csr'), Lambda_e) if X_e else []
+    p_a = perc.predict_batch(vstack(X_a, format='csr'), Lambda_a) if X_a else []
                         
     f_fill_this = utils.load_json_file(test_file)    
     counter_e = 0
@@ -4,10 +4,14 @@ import cPickle
 from collections import defaultdict
 from pprint import pprint
 import feature_vector
+import feature_store
+import dataset
+import parallel_extraction
+import crossvalidation_folds
 import utils
 import numpy as np
 import random
-from scipy.sparse import vstack
+from scipy.sparse import vstack, coo_matrix
 import naivebayes2 as nb
 import utils
 import warnings
@@ -17,126 +21,74 @@ import time
 
 
 
-# generate one training batch in perceptron algorithm for event triggers. 
-# output: For all events in file file_name: the features (matrix) & triggers
-def build_trigger_data_batch(file_name, FV, clf):
-	trigger_list = []
-	token_index_list = []
-	sentence_list = []
-	f_json = utils.load_json_file(file_name)
-
-	for sentence in f_json['sentences']:
-		event_candidates_list = sentence['eventCandidates']
-		for event in event_candidates_list:
-			token_index_list.append( event['begin'] )
-			sentence_list.append(sentence)
-			trigger_list += [ event['gold'] ]
-
-	matrix_list = []
-	for token_index,sentence in zip(token_index_list, sentence_list):
-		matrix_list.append( FV.get_feature_matrix(token_index, sentence, clf) )
-
-	if len(matrix_list) == 0:
-		return None, None
-	
-	if clf=='perc':
-		return matrix_list, trigger_list
-	elif clf=='nb':
-		return vstack(matrix_list), trigger_list	
-
-# generate one training batch in perceptron algorithm for argument labels. 
-# output: For all argument candidates in file file_name: 
-# the features (matrix) & gold label of the trigger-argument relation
-def build_argument_data_batch(file_name, FV, clf):
-	gold_list = []
-	matrix_list = []
-	f_json = utils.load_json_file(file_name)
-
-	for sentence in f_json['sentences']:
-		event_candidates_list = sentence['eventCandidates']
-		for event in event_candidates_list:
-			argumentslist = event['arguments']
-			for argument in argumentslist:
-				arg_index = argument['begin']
-				token_index = event['begin'] 
-				matrix_list.append( FV.get_feature_matrix_argument_prediction(token_index, arg_index, sentence, clf) )
-				gold_list.append( argument['gold'] )
-
-	if len(matrix_list) == 0:
-		return None, None
-
-	if clf=='perc':
-		return matrix_list, gold_list
-	elif clf=='nb':
-		return vstack(matrix_list), gold_list
-
-
-def build_dataset(file_list, FV, ind, kind='train', mode='trig', clf='nb', load=True):
+def build_dataset(file_list, FV, ind, kind='train', mode='trig', clf='nb', load=True, n_jobs=1):
 	"""
 	This function construct the data matrix X and target vector y.
 
+	The features of every document come from the per-document feature store
+	(see feature_store.py) and are only computed for documents that are not
+	cached yet for the feature space of FV.
+
 	Arguments:
-	- clf: string -> 'nb' for naivebayes, 'perc' for perceptron
+	- clf: string -> 'nb' for naivebayes, 'perc' for perceptron, 'data' for a
+	  dataset.Dataset (accepted by both)
 	- kind: string -> 'train' or 'valid' or 'test'
+	- ind, kind: not needed any more with the per-document store, kept so that
+	  existing calls keep working
+	- load: if False, recompute the features of all files in file_list
+	- n_jobs: number of worker processes computing missing features
 
 	Output:
-	- X: data matrix which depends per type of classifier specified by mode
+	- X: data matrix (nb), list of feature rows (perc) or dataset.Dataset (data)
 	- y: vector of classes
 	"""
-	if load:
-		print 'Loading feature matrix X and target vector y from file.'
-		file_name_pickle = "Xy_{0}_{1}_{2}_{3}.data".format(kind,mode,clf,ind)
-		f = open(file_name_pickle,"rb")
-		X, y = cPickle.load(f)
-		f.close()
-		return X, y
+	if mode == 'trig':
+		store_mode, label_list = 'trigger', FV.trigger_list
+	elif mode == 'arg':
+		store_mode, label_list = 'argument', FV.arguments_list
 	else:
-		if clf == 'nb':
-			for file_index, file_name in enumerate(file_list):
-				print 'Building test data from json file ',file_index , 'of', len(file_list)
-				if mode == 'trig':
-					if file_index == 0:
-						X, y = build_trigger_data_batch(file_name, FV, clf='nb')
-					else:
-						(new_features, new_gold) = build_trigger_data_batch(file_name, FV, clf='nb')
-						if new_features == None:
-							continue
-						else:
-							X = vstack((X,new_features))
-							y += new_gold
-				elif mode == 'arg':
-					if file_index == 0:
-						X, y = build_argument_data_batch(file_name, FV, clf='nb')
-					else:
-						(new_features, new_gold) = build_argument_data_batch(file_name, FV, clf='nb')
-						if new_features == None:
-							continue
-						else:
-							X = vstack((X,new_features))
-							y += new_gold
-				else:
-					warnings.warn('Error in build_dataset: Must have mode "Trigger" or "Argument"!')
-		elif clf == 'perc':
-			X = []
-			y = []
-			for file_index, file_name in enumerate(file_list):
-				print 'Building test data from json file ',file_index , 'of', len(file_list)
-				if mode == 'trig':
-					(feat_list_one_file, gold_list_one_file) = build_trigger_data_batch(filename, FV, clf='perc')
-				elif mode == 'arg':
-					(feat_list_one_file, gold_list_one_file) = build_argument_data_batch(filename, FV, clf='perc')
-				else:
-					warnings.warn('Error in build_dataset: Must have mode "Trigger" or "Argument"!' )
-				X += feat_list_one_file
-				y += gold_list_one_file
-		else:
-			warnings.warn('Error in build_dataset: Must have clf "nb" or "perc"!')
-
-		file_name_pickle = "Xy_{0}_{1}_{2}_{3}.data".format(kind,mode,clf,ind)
-		f = open(file_name_pickle,"w")
-		cPickle.dump((X,y),f)
-		f.close()
+		warnings.warn('Error in build_dataset: Must have mode "Trigger" or "Argument"!')
+
+	store = feature_store.FeatureStore(FV)
+	X, y_ids = store.assemble(file_list, store_mode, refresh = not load, n_jobs = n_jobs)
+	y = [label_list[i] for i in y_ids]
+
+	if clf == 'nb':
 		return X, y
+	elif clf == 'perc':
+		return [X.getrow(i) for i in range(X.shape[0])], y
+	elif clf == 'data':
+		return dataset.Dataset.from_csr(X, y_ids), y
+	else:
+		warnings.warn('Error in build_dataset: Must have clf "nb", "perc" or "data"!')
+
+def naivebayes_counts(file_name, FV, store, mode):
+	"""
+	NaiveBayes counts of the candidates of one document, from its feature
+	store block. mode: 'trig' or 'arg'.
+	"""
+	if mode == 'trig':
+		store_mode, label_list = 'trigger', FV.trigger_list
+	else:
+		store_mode, label_list = 'argument', FV.arguments_list
+	block = store.block(file_name, store_mode)
+	y = [label_list[i] for i in block.labels]
+	return nb.NaiveBayes().partial_fit(block.to_csr(), y, classes=list(label_list))
+
+def train_naivebayes(file_list, FV, mode='trig', k=1.0, n_jobs=None):
+	"""
+	Train NaiveBayes as a map-reduce over the documents in file_list: the
+	counts of every document are computed on n_jobs worker processes (None:
+	all cores) and merged afterwards. New documents can be added later with
+	merge(naivebayes_counts(...)) and finalize().
+	"""
+	store = feature_store.FeatureStore(FV)
+	counts = parallel_extraction.map_documents(naivebayes_counts, file_list, FV,
+	                                           args=(store, mode), n_jobs=n_jobs)
+	NB = nb.NaiveBayes(k)
+	for document_counts in counts:
+		NB.merge(document_counts)
+	return NB.finalize()
 
 def crossvalidation(file_list, load, k=3, mode='trig', clf='nb', r=0.6):
 	if mode=='trig':
@@ -144,6 +96,11 @@ def crossvalidation(file_list, load, k=3, mode='trig', clf='nb', r=0.6):
 	elif mode=='arg':
 		FV = feature_vector.FeatureVector('argument')
 
+	if clf=='perc':
+		# folds assembled from cached per-document features, run in parallel
+		folds = crossvalidation_folds.Folds(FV, file_list, k=k)
+		return folds.run('perc', mode='Trigger' if mode=='trig' else 'Argument', subs_rate=r)
+
 	random.shuffle(file_list)
 	chunks = [ file_list[i::k] for i in xrange(k) ]
 	
@@ -162,9 +119,9 @@ def crossvalidation(file_list, load, k=3, mode='trig', clf='nb', r=0.6):
 
 		if clf=='nb':
 			NB = nb.NaiveBayes()
-			NB.train(np.asarray(X_train.todense()),np.asarray(y_train))
+			NB.train(X_train,np.asarray(y_train))
 
-			_, prec, rec, F1 = NB.evaluate(np.asarray(X_valid.todense()), np.asarray(y_valid))
+			_, prec, rec, F1 = NB.evaluate(X_valid, np.asarray(y_valid))
 			# results_dict = {'prec': prec, 'rec': rec, 'F1': F1}
 			result['prec'].append(prec)
 			result['rec'].append(rec)
@@ -173,9 +130,6 @@ def crossvalidation(file_list, load, k=3, mode='trig', clf='nb', r=0.6):
 			# run = 'Run {0}'.format(ind+1)
 			# result.update({run: results_dict})
 
-		elif clf=='perc':
-			raise NotImplementedError
-
 	result.update((x, round(np.mean(y), 4)) for x, y in result.items())
 	return result
 
@@ -184,7 +138,7 @@ def crossvalidation(file_list, load, k=3, mode='trig', clf='nb', r=0.6):
 #subsample the >None< events, to obtain more balanced data set.
 def subsample(feature_list, trigger_list, clf, subsampling_rate = 0.75):
 	"""
-	clf: string -> 'perc' or 'nb'
+	clf: string -> 'perc', 'nb' or 'data'
 	"""
 
 	None_indices = [i for (i,trigger) in enumerate(trigger_list) if trigger == u'None']
@@ -213,8 +167,87 @@ def subsample(feature_list, trigger_list, clf, subsampling_rate = 0.75):
 		subsampled_feature_list = feature_list.tocsr()[remaining_entries].tocoo()
 		subsampled_trigger_list = np.asarray([trigger_list[i] for i in remaining_entries ])
 		return subsampled_feature_list, subsampled_trigger_list
+	elif clf=='data':
+		subsampled_feature_list = feature_list.subset(remaining_entries)
+		subsampled_trigger_list = np.asarray([trigger_list[i] for i in remaining_entries ])
+		return subsampled_feature_list, subsampled_trigger_list
+
+def subsampled_counts(X, y, list_of_rates):
+	"""
+	NaiveBayes counts (not finalized) for every subsampling rate in
+	list_of_rates from one pass over (X, y). Every 'None' sample gets one
+	uniform random number u and is kept at rate r if u < 1 - r, so the kept
+	'None' samples of the rates are nested. The 'None' counts are counted per
+	bin between two rates and summed up per rate, the other classes are
+	counted once.
+	"""
+	X = X.tocsr()
+	y = np.asarray(y)
+	classes = np.unique(y)
+	is_None = y == u'None'
+	other = nb.NaiveBayes().partial_fit(X[np.flatnonzero(~is_None)], y[~is_None], classes=classes)
+
+	X_None = X[np.flatnonzero(is_None)]
+	u = np.random.uniform(0, 1, X_None.shape[0])
+	thresholds = np.unique([1.0 - rate for rate in list_of_rates])
+	#bin b: thresholds[b-1] <= u < thresholds[b], kept for thresholds[b] and above
+	bins = np.searchsorted(thresholds, u, side='right')
+	B = coo_matrix((np.ones(len(bins)), (np.arange(len(bins)), bins)),
+	               shape=(len(bins), len(thresholds) + 1)).tocsr()
+	bin_class_count = np.cumsum(np.asarray(B.sum(axis=0)).ravel())
+	bin_feature_count = np.cumsum(np.asarray(X_None.T.dot(B).todense()), axis=1)
+
+	None_ind = np.flatnonzero(classes == u'None')
+	counts = {}
+	for rate in list_of_rates:
+		b = np.searchsorted(thresholds, 1.0 - rate)
+		NB = nb.NaiveBayes().merge(other)
+		NB.class_count[None_ind] += bin_class_count[b]
+		NB.feature_count[None_ind] += bin_feature_count[:, b]
+		counts[rate] = NB
+	return counts
+
+def crossvalidation_sweep(file_list, load, list_of_rates, k=3, mode='trig'):
+	"""
+	crossvalidation of NaiveBayes for all subsampling rates at once: every fold
+	is built and counted once (see subsampled_counts) and only finalized and
+	evaluated per rate. Unlike subsample, the 'None' samples are kept
+	independently with probability 1 - rate.
+	"""
+	if mode=='trig':
+		FV = feature_vector.FeatureVector('trigger')
+	elif mode=='arg':
+		FV = feature_vector.FeatureVector('argument')
+
+	random.shuffle(file_list)
+	chunks = [ file_list[i::k] for i in xrange(k) ]
+
+	results = dict((rate, defaultdict(list)) for rate in list_of_rates)
+
+	for ind, chunk in enumerate(chunks):
+		train_list = [item for sublist in chunks[:ind] + chunks[ind+1:] for item in sublist]
+		valid_list = chunk
+		X_train, y_train = build_dataset(train_list, FV, ind=ind, kind='train', mode=mode, clf='nb', load=load)
+		X_valid, y_valid = build_dataset(valid_list, FV, ind=ind, kind='valid', mode=mode, clf='nb', load=load)
+
+		for rate, NB in subsampled_counts(X_train, y_train, list_of_rates).items():
+			_, prec, rec, F1 = NB.finalize().evaluate(X_valid, np.asarray(y_valid))
+			results[rate]['prec'].append(prec)
+			results[rate]['rec'].append(rec)
+			results[rate]['F1'].append(F1)
+
+	for result in results.values():
+		result.update((x, round(np.mean(y), 4)) for x, y in result.items())
+	return results
+
+def crossvalidation_experiment(list_of_rates, file_list, load, mode, k=3, sweep=False):
+	"""
+	sweep: if True, run all rates on the same folds, counting every fold only
+	once (see crossvalidation_sweep)
+	"""
+	if sweep:
+		return crossvalidation_sweep(file_list, load, list_of_rates, k=k, mode=mode)
 
-def crossvalidation_experiment(list_of_rates, file_list, load, mode, k=3):
 	result = {}
 	for rate in list_of_rates:
 		result.update({rate: crossvalidation(file_list, load=load, k=k, mode=mode, r=rate)})
@@ -262,17 +295,17 @@ def main():
 	X_valid, y_valid = build_dataset(valid_list, FV_trig, ind=1, kind='valid', mode='trig', clf='nb', load=True)
 
 	NB_trig = nb.NaiveBayes()
-	NB_trig.train(np.asarray(X_train.todense()),np.asarray(y_train))
+	NB_trig.train(X_train,np.asarray(y_train))
 
 	# print "Evaluate Naive Bayes classifer predicting triggers on the train set..."
-	# CM, prec, rec, F1 = NB_trig.evaluate(np.asarray(X_train.todense()), np.asarray(y_train))
+	# CM, prec, rec, F1 = NB_trig.evaluate(X_train, np.asarray(y_train))
 	# print "Precision: {0}".format(prec)
 	# print "Recall: {0}".format(rec)
 	# print "F1-measure: {0}".format(F1)
 	# print "Confusion matrix:\n", np.int64(CM)
 
 	print "Evaluate Naive Bayes classifer predicting triggers on the validation set..."
-	CM, prec, rec, F1 = NB_trig.evaluate(np.asarray(X_valid.todense()), np.asarray(y_valid))
+	CM, prec, rec, F1 = NB_trig.evaluate(X_valid, np.asarray(y_valid))
 	print "Precision: {0}".format(prec)
 	print "Recall: {0}".format(rec)
 	print "F1-measure: {0}".format(F1)
@@ -288,17 +321,17 @@ def main():
 	X_valid, y_valid = build_dataset(valid_list, FV_arg, ind=1, kind='valid', mode='arg', clf='nb', load=True)
 
 	NB_arg = nb.NaiveBayes()
-	NB_arg.train(np.asarray(X_train.todense()), np.asarray(y_train))
+	NB_arg.train(X_train, np.asarray(y_train))
 
 	# print "Evaluate Naive Bayes classifer predicting arguments on the train set..."
-	# CM, prec, rec, F1 = NB_arg.evaluate(np.asarray(X_train.todense()), np.asarray(y_train))
+	# CM, prec, rec, F1 = NB_arg.evaluate(X_train, np.asarray(y_train))
 	# print "Precision: {0}".format(prec)
 	# print "Recall: {0}".format(rec)
 	# print "F1-measure: {0}".format(F1)
 	# print "Confusion matrix:\n", np.int64(CM)
 
 	print "Evaluate Naive Bayes classifer predicting arguments on the validation set..."
-	CM, prec, rec, F1 = NB_arg.evaluate(np.asarray(X_valid.todense()), np.asarray(y_valid))
+	CM, prec, rec, F1 = NB_arg.evaluate(X_valid, np.asarray(y_valid))
 	print "Precision: {0}".format(prec)
 	print "Recall: {0}".format(rec)
 	print "F1-measure: {0}".format(F1)
@@ -0,0 +1,101 @@
+"""
+Benchmark of the constrained joint decoders on small synthetic events: the
+exact decoder (joint_decoding.decode_exact) is checked against exhaustive
+enumeration of all label structures, and the decode time per event is compared
+with the heuristic decoder (joint_perceptron.decode_constrained) and the
+batched one (joint_decoding.decode_constrained_batch).
+
+Usage: python benchmark_joint_decoding.py [N_events] [max_arguments]
+"""
+
+import sys
+import time
+import itertools
+import numpy as np
+import joint_perceptron
+import joint_decoding
+
+
+#class ids as in the bionlp2011genia trigger_list and arguments_list
+CLASSES = {'None_trigger': 0,
+           'Regulation_triggers': [6, 7, 9],
+           'Other_triggers': [1, 2, 3, 4, 5, 8],
+           'None_argument': 0,
+           'Theme_argument': 1,
+           'Cause_argument': 2}
+N_TRIGGER_CLASSES = 10
+N_ARGUMENT_CLASSES = 3
+
+
+# total score of a structure
+def structure_score(trigger_scores, argument_scores, e, a):
+    return trigger_scores[e] + sum(argument_scores[j][a[j]] for j in range(len(a)))
+
+
+# highest score of all structures that satisfy the constraints, by enumeration
+def exhaustive_best_score(trigger_scores, argument_scores, classes):
+    N_arguments = len(argument_scores)
+    best = structure_score(trigger_scores, argument_scores, classes['None_trigger'],
+                           [classes['None_argument']]*N_arguments)
+    groups = [(classes['Regulation_triggers'], range(N_ARGUMENT_CLASSES)),
+              (classes['Other_triggers'], [classes['None_argument'], classes['Theme_argument']])]
+    for trigger_classes, argument_classes in groups:
+        for e in trigger_classes:
+            for a in itertools.product(argument_classes, repeat = N_arguments):
+                if N_arguments and classes['Theme_argument'] not in a:
+                    continue
+                best = max(best, structure_score(trigger_scores, argument_scores, e, a))
+    return best
+
+
+# random events with 0..max_arguments arguments each
+def synthetic_events(N_events, max_arguments, seed = 0):
+    rng = np.random.RandomState(seed)
+    events = []
+    for _ in range(N_events):
+        N_arguments = rng.randint(0, max_arguments+1)
+        events.append( (rng.normal(0.0, 1.0, N_TRIGGER_CLASSES),
+                        rng.normal(0.0, 1.0, [N_arguments, N_ARGUMENT_CLASSES])) )
+    return events
+
+
+def time_per_event(decode, events):
+    t_start = time.time()
+    results = [decode(trigger_scores, argument_scores, CLASSES)
+               for trigger_scores, argument_scores in events]
+    return (time.time() - t_start) / len(events), results
+
+
+def main(N_events = 2000, max_arguments = 6):
+    events = synthetic_events(N_events, max_arguments)
+
+    t_heuristic, heuristic = time_per_event(joint_perceptron.decode_constrained, events)
+    t_exact, exact = time_per_event(joint_decoding.decode_exact, events)
+
+    groups = np.concatenate([[0], np.cumsum([len(a) for _, a in events])])
+    t_start = time.time()
+    joint_decoding.decode_constrained_batch(np.array([t for t, _ in events]),
+                                            np.concatenate([a for _, a in events]),
+                                            groups, CLASSES)
+    t_batch = (time.time() - t_start) / N_events
+
+    exact_optimal = 0
+    heuristic_optimal = 0
+    for (trigger_scores, argument_scores), (e_x, a_x), (e_h, a_h) in zip(events, exact, heuristic):
+        best = exhaustive_best_score(trigger_scores, argument_scores, CLASSES)
+        if np.isclose(structure_score(trigger_scores, argument_scores, e_x, a_x), best):
+            exact_optimal += 1
+        if np.isclose(structure_score(trigger_scores, argument_scores, e_h, a_h), best):
+            heuristic_optimal += 1
+
+    print N_events, 'synthetic events with up to', max_arguments, 'arguments'
+    print 'exact decoder optimal:    ', exact_optimal, 'of', N_events
+    print 'heuristic decoder optimal:', heuristic_optimal, 'of', N_events
+    print 'time per event [microseconds]:'
+    print '  heuristic (per event):', round(1e6 * t_heuristic, 1)
+    print '  exact (per event):    ', round(1e6 * t_exact, 1)
+    print '  heuristic (batched):  ', round(1e6 * t_batch, 1)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
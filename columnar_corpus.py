@@ -0,0 +1,188 @@
+"""
+Columnar binary corpus format. convert_corpus stores the bionlp2011genia json
+files as flat int32 arrays (one .npy file per column) that are memory-mapped on
+loading, so documents can be featurized without parsing any json:
+
+- tokens: word, pos and stem ids, interned in strings.json
+- deps: (head, mod, label id) per dependency, with sentence-local token indices
+- mentions, event candidates and argument candidates: begin/end token indices
+  and gold label ids
+- *_offsets arrays: CSR-style offsets of sentences per document, and of tokens,
+  deps, mentions and events per sentence, and of arguments per event.
+
+iter_sentences gives a uniform view of a document in either format.
+"""
+
+import io
+import os
+import json
+import hashlib
+import numpy as np
+import utils
+from feature_vector import SentenceIndex
+
+
+STRING_TABLES = ['words', 'pos_tags', 'stems', 'dep_labels', 'labels']
+COLUMNS = ['document_offsets',
+           'token_offsets', 'token_word', 'token_pos', 'token_stem',
+           'dep_offsets', 'dep_head', 'dep_mod', 'dep_label',
+           'mention_offsets', 'mention_begin', 'mention_end',
+           'event_offsets', 'event_begin', 'event_end', 'event_gold',
+           'argument_offsets', 'argument_begin', 'argument_end', 'argument_gold']
+
+
+# convert the json files in file_list into a columnar corpus in directory.
+def convert_corpus(file_list, directory):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tables = dict((name, {}) for name in STRING_TABLES)
+    columns = dict((name, []) for name in COLUMNS)
+    for name in COLUMNS:
+        if name.endswith('_offsets'):
+            columns[name].append(0)
+
+    def intern(table, string):
+        return tables[table].setdefault(string, len(tables[table]))
+
+    for i_f, file_name in enumerate(file_list):
+        print 'Converting json file', i_f, 'of', len(file_list)
+        f_json = utils.load_json_file(file_name)
+        for sentence in f_json['sentences']:
+            for token in sentence['tokens']:
+                columns['token_word'].append(intern('words', token['word']))
+                columns['token_pos'].append(intern('pos_tags', token['pos']))
+                columns['token_stem'].append(intern('stems', token['stem']))
+            for dep in sentence['deps']:
+                columns['dep_head'].append(dep['head'])
+                columns['dep_mod'].append(dep['mod'])
+                columns['dep_label'].append(intern('dep_labels', dep['label']))
+            for mention in sentence['mentions']:
+                columns['mention_begin'].append(mention['begin'])
+                columns['mention_end'].append(mention['end'])
+            for ec in sentence['eventCandidates']:
+                columns['event_begin'].append(ec['begin'])
+                columns['event_end'].append(ec['end'])
+                columns['event_gold'].append(intern('labels', ec['gold']))
+                for argument in ec['arguments']:
+                    columns['argument_begin'].append(argument['begin'])
+                    columns['argument_end'].append(argument['end'])
+                    columns['argument_gold'].append(intern('labels', argument['gold']))
+                columns['argument_offsets'].append(len(columns['argument_begin']))
+            columns['token_offsets'].append(len(columns['token_word']))
+            columns['dep_offsets'].append(len(columns['dep_head']))
+            columns['mention_offsets'].append(len(columns['mention_begin']))
+            columns['event_offsets'].append(len(columns['event_begin']))
+        columns['document_offsets'].append(len(columns['token_offsets']) - 1)
+
+    for name in COLUMNS:
+        np.save(os.path.join(directory, name + '.npy'),
+                np.asarray(columns[name], dtype = np.int32))
+    strings = dict((name, sorted(table, key = table.get))
+                   for name, table in tables.items())
+    strings['documents'] = [os.path.basename(f) for f in file_list]
+    with io.open(os.path.join(directory, 'strings.json'), 'w', encoding = 'utf-8') as f:
+        f.write(unicode(json.dumps(strings, ensure_ascii = False)))
+    return ColumnarCorpus(directory)
+
+
+"""
+Read-only, memory-mapped columnar corpus as written by convert_corpus.
+"""
+class ColumnarCorpus(object):
+    def __init__(self, directory):
+        self.directory = directory
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'),
+                                        mmap_mode = 'r'))
+        with io.open(os.path.join(directory, 'strings.json'), encoding = 'utf-8') as f:
+            strings = json.load(f)
+        for name in STRING_TABLES:
+            setattr(self, name, strings[name])
+        self.document_names = strings['documents']
+        self._document_ids = dict((name, i) for i, name in enumerate(self.document_names))
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.document_names)
+
+    #sha1 of the content of all column files and the string tables, computed once
+    def fingerprint(self):
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            for file_name in ['strings.json'] + [name + '.npy' for name in COLUMNS]:
+                with open(os.path.join(self.directory, file_name), 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        h.update(chunk)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    #all documents, in the order of the file list they were converted from
+    def documents(self):
+        return [ColumnarDocument(self, i) for i in range(len(self))]
+
+    #document converted from the json file file_name (compared by base name)
+    def document(self, file_name):
+        return ColumnarDocument(self, self._document_ids[os.path.basename(file_name)])
+
+
+"""
+One document of a ColumnarCorpus. Can be passed wherever a json file name is
+expected by the build_*_data_batch functions.
+"""
+class ColumnarDocument(object):
+    def __init__(self, corpus, doc_id):
+        self.corpus = corpus
+        self.doc_id = doc_id
+        self.name = corpus.document_names[doc_id]
+
+    def __repr__(self):
+        return 'ColumnarDocument(%r)' % self.name
+
+    #yields (SentenceIndex, event candidates) per sentence, see iter_sentences
+    def sentences(self):
+        c = self.corpus
+        first, last = c.document_offsets[self.doc_id:self.doc_id+2]
+        for s in range(first, last):
+            t0, t1 = c.token_offsets[s:s+2]
+            d0, d1 = c.dep_offsets[s:s+2]
+            m0, m1 = c.mention_offsets[s:s+2]
+            e0, e1 = c.event_offsets[s:s+2]
+            sentence = SentenceIndex(
+                [c.words[i] for i in c.token_word[t0:t1].tolist()],
+                [c.pos_tags[i] for i in c.token_pos[t0:t1].tolist()],
+                [c.stems[i] for i in c.token_stem[t0:t1].tolist()],
+                zip(c.dep_head[d0:d1].tolist(), c.dep_mod[d0:d1].tolist(),
+                    [c.dep_labels[i] for i in c.dep_label[d0:d1].tolist()]),
+                zip(c.mention_begin[m0:m1].tolist(), c.mention_end[m0:m1].tolist()))
+
+            events = []
+            argument_offsets = c.argument_offsets[e0:e1+1].tolist()
+            for e, (a0, a1) in enumerate(zip(argument_offsets[:-1], argument_offsets[1:])):
+                arguments = zip(c.argument_begin[a0:a1].tolist(),
+                                [c.labels[i] for i in c.argument_gold[a0:a1].tolist()])
+                events.append( (int(c.event_begin[e0+e]), c.labels[c.event_gold[e0+e]],
+                                arguments) )
+            yield sentence, events
+
+
+# iterate over the sentences of a document: a json file name or a
+# ColumnarDocument. Yields for every sentence its SentenceIndex and its event
+# candidates as (trigger token index, gold, arguments), where arguments is a list
+# of (argument token index, gold).
+def iter_sentences(document):
+    if isinstance(document, ColumnarDocument):
+        for sentence in document.sentences():
+            yield sentence
+    else:
+        f_json = utils.load_json_file(document)
+        for sentence in f_json['sentences']:
+            events = [(ec['begin'], ec['gold'],
+                       [(argument['begin'], argument['gold']) for argument in ec['arguments']])
+                      for ec in sentence['eventCandidates']]
+            yield SentenceIndex.from_json(sentence), events
+
+
+if 0:
+    #convert the training corpus once; afterwards pass its documents instead of
+    #json file names, e.g. build_trigger_data_batch(corpus.document(f), FV, 'perc')
+    corpus = convert_corpus(utils.list_files(), 'bionlp2011genia-train-columnar')
@@ -0,0 +1,163 @@
+"""
+Single pass corpus statistics. All counters behind the vocabularies in utils
+(triggers, arguments, grammar tags, dep labels, typical trigger/argument stems,
+trigger->argument deps and trigger mods) are computed together, one json parse
+per file, map-reduced over a process pool. compute_vocabularies extends the presaved
+vocabulary files with new entries, keeping their order; write_vocabularies
+also writes every vocabulary file back in one go.
+"""
+
+import os
+import cPickle
+import multiprocessing
+from collections import Counter, defaultdict
+import utils
+
+
+# counters of one file. Nested counters are per gold label.
+def count_file(file_name):
+    stats = empty_statistics()
+    f_json = utils.load_json_file(file_name)
+    for sentence in f_json['sentences']:
+        tokens = sentence['tokens']
+        for token in tokens:
+            stats['grammar_tags'][token['pos']] += 1
+
+        head_deps = defaultdict(list)
+        for dep in sentence['deps']:
+            stats['dep_labels'][dep['label']] += 1
+            head_deps[dep['head']].append(dep)
+
+        for ec in sentence['eventCandidates']:
+            trigger = ec['gold']
+            stats['triggers'][trigger] += 1
+            stats['trigger_stems'][trigger][tokens[ec['begin']]['stem']] += 1
+            #words that are mod of a dependency headed by the trigger
+            for head in range(ec['begin'], ec['end']+1):
+                for dep in head_deps[head]:
+                    stats['trigger_mods'][tokens[dep['mod']]['word']] += 1
+
+            for argument in ec['arguments']:
+                label = argument['gold']
+                stats['arguments'][label] += 1
+                stats['argument_stems'][label][tokens[argument['begin']]['stem']] += 1
+                for dep in head_deps[ec['begin']]:
+                    if dep['mod'] == argument['begin']:
+                        stats['trig2arg_deps'][trigger][dep['label']] += 1
+    return stats
+
+
+def empty_statistics():
+    return {'triggers': Counter(),
+            'arguments': Counter(),
+            'grammar_tags': Counter(),
+            'dep_labels': Counter(),
+            'trigger_mods': Counter(),
+            'trigger_stems': defaultdict(Counter),
+            'argument_stems': defaultdict(Counter),
+            'trig2arg_deps': defaultdict(Counter)}
+
+
+# add the counts of other to stats (in place) and return stats.
+def merge_statistics(stats, other):
+    for key, counts in other.items():
+        if isinstance(counts, Counter):
+            stats[key].update(counts)
+        else:
+            for label, label_counts in counts.items():
+                stats[key][label].update(label_counts)
+    return stats
+
+
+# statistics of the whole corpus, counted in parallel over n_jobs processes.
+def compute_corpus_statistics(file_list = None, n_jobs = None):
+    if file_list is None:
+        file_list = utils.list_files()
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+
+    stats = empty_statistics()
+    if n_jobs == 1:
+        for file_name in file_list:
+            merge_statistics(stats, count_file(file_name))
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            chunksize = max(1, len(file_list) // (4*n_jobs))
+            for file_stats in pool.imap_unordered(count_file, file_list, chunksize):
+                merge_statistics(stats, file_stats)
+        finally:
+            pool.close()
+            pool.join()
+    return stats
+
+
+# entries observed more than cutoff times for any label (other than 'None',
+# if skip_none)
+def _typical(counts_per_label, cutoff, skip_none = True):
+    typical = set()
+    for label, counts in counts_per_label.items():
+        if skip_none and label == u'None':
+            continue
+        typical.update(key for key, count in counts.items() if count > cutoff)
+    return sorted(typical)
+
+
+# every vocabulary defines class ids or feature columns (which the pretrained
+# weights depend on), so keep the order of an existing saved list and only
+# append new entries.
+def _extend_saved_list(file_name, keys):
+    saved = []
+    if os.path.exists(file_name):
+        with open(file_name, 'rb') as f:
+            saved = utils.correct_end_of_lines_in_saved_list(cPickle.load(f))
+    known = set(saved)
+    return saved + sorted(key for key in keys if key not in known)
+
+
+# file every vocabulary is saved to, as read by the loaders in utils.
+VOCABULARY_FILES = {
+    'trigger_list': 'trigger_list.data',
+    'all_grammar_tags': 'grammar_tags_list.data',
+    'dep_list_total': 'dep_list_total.data',
+    'stem_list_triggers': 'stem_list_trigger.data',
+    'stem_list_arguments': 'stem_list_arguments.data',
+    'trig2arg_deps': 'trig2arg_deps.data',
+    'mod_list_triggers': 'stem_mod_trigger.data',
+    'mod_list_total': 'mod_list_total.data',
+}
+
+
+# all vocabularies from the statistics, under the same cutoffs as feature_space,
+# each extended from its saved vocabulary file
+def vocabularies_from_statistics(stats, cutoffs):
+    entries = {
+        'trigger_list': stats['triggers'],
+        'all_grammar_tags': stats['grammar_tags'],
+        'dep_list_total': stats['dep_labels'],
+        'stem_list_triggers': _typical(stats['trigger_stems'], cutoffs['stem_trigger']),
+        'stem_list_arguments': _typical(stats['argument_stems'], cutoffs['stem_argument']),
+        'trig2arg_deps': _typical(stats['trig2arg_deps'], cutoffs['trig2arg_dep'],
+                                  skip_none = False),
+        'mod_list_triggers': [mod for mod, count in stats['trigger_mods'].items()
+                              if count > cutoffs['mod_trigger']],
+        'mod_list_total': stats['trigger_mods'],
+    }
+    return dict((name, _extend_saved_list(VOCABULARY_FILES[name], keys))
+                for name, keys in entries.items())
+
+
+# compute all vocabularies in a single corpus pass, without writing anything.
+def compute_vocabularies(cutoffs, file_list = None, n_jobs = None):
+    return vocabularies_from_statistics(compute_corpus_statistics(file_list, n_jobs), cutoffs)
+
+
+# compute all vocabularies in a single corpus pass and write all of them. This
+# rewrites the presaved vocabulary files, so only call it to rebuild them on
+# purpose.
+def write_vocabularies(cutoffs, file_list = None, n_jobs = None):
+    vocabularies = compute_vocabularies(cutoffs, file_list, n_jobs)
+    for name, file_name in VOCABULARY_FILES.items():
+        with open(file_name, 'wb') as f:
+            cPickle.dump(vocabularies[name], f)
+    return vocabularies
@@ -0,0 +1,185 @@
+"""
+k-fold crossvalidation on cached per-document features. Every document is
+featurized once (per mode, through a feature_store.FeatureStore) and the
+train/valid Datasets of every fold are assembled from the blocks of its
+documents, so no fold runs the phi_* templates again. The folds are split by
+document, as in assignment2.crossvalidation.
+
+The k folds are trained and evaluated concurrently on a pool of worker
+processes. As in parallel_training, the folds (including the memory-mapped
+blocks) are put into a module global before the pool is forked, so only the
+fold number is sent to every worker.
+
+Classifiers:
+- 'nb': naivebayes2.NaiveBayes, mode 'Trigger' or 'Argument'
+- 'perc': perceptron_sketch.train_perceptron, mode 'Trigger' or 'Argument'
+- 'joint': joint_perceptron.train_perceptron_joint, mode 'Joint_unconstrained'
+  or 'Joint_constrained'
+"""
+
+import random
+import multiprocessing
+from collections import defaultdict
+import numpy as np
+import feature_store
+import dataset
+import utils
+import naivebayes2 as nb
+import perceptron_sketch as perceptron
+import joint_perceptron as jnt
+
+
+#(folds, evaluate function, mode, parameters) of the running run() call
+_task = None
+
+
+def _run_fold(i):
+    folds, evaluate_fold, mode, params, seed = _task
+    #forked workers inherit the same random state, give every fold its own
+    np.random.seed(None if seed is None else seed + i)
+    return evaluate_fold(folds, i, mode, **params)
+
+
+"""
+Document folds of file_list with the cached feature blocks of all documents.
+"""
+class Folds(object):
+    def __init__(self, FV, file_list, k = 3, store = None, n_jobs = None, shuffle = True):
+        """
+        store: feature_store.FeatureStore to take the features from (default:
+        the store of FV's feature space)
+        n_jobs: processes to featurize missing documents on (None: all cores)
+        """
+        self.FV = FV
+        self.file_list = list(file_list)
+        if shuffle:
+            random.shuffle(self.file_list)
+        self.k = k
+        #document numbers of every fold
+        self.chunks = [range(i, len(self.file_list), k) for i in xrange(k)]
+        self.store = feature_store.FeatureStore(FV) if store is None else store
+        self.n_jobs = n_jobs
+        self._blocks = {}
+
+    #feature blocks of all documents in mode ('trigger' or 'argument'),
+    #featurized on first use only
+    def blocks(self, mode):
+        if mode not in self._blocks:
+            self._blocks[mode] = [feature_store.FeatureBlock.load(block_file) for block_file
+                                  in self.store.fill(self.file_list, mode, n_jobs = self.n_jobs)]
+        return self._blocks[mode]
+
+    #document numbers of the training and validation part of fold i
+    def documents(self, i):
+        train = [d for j, chunk in enumerate(self.chunks) if j != i for d in chunk]
+        return train, self.chunks[i]
+
+    #(train Dataset, valid Dataset) of fold i, mode 'Trigger' or 'Argument'
+    def split(self, i, mode):
+        store_mode = 'trigger' if mode == 'Trigger' else 'argument'
+        n_cols = self.FV.dim_trigger if mode == 'Trigger' else self.FV.dim_argument
+        blocks = self.blocks(store_mode)
+        return tuple(dataset.Dataset.from_blocks([blocks[d] for d in documents], n_cols)
+                     for documents in self.documents(i))
+
+    #(train, valid) joint datasets of fold i, see dataset.load_joint_dataset
+    def joint_split(self, i):
+        trigger_blocks = self.blocks('trigger')
+        argument_blocks = self.blocks('argument')
+        return tuple(dataset.joint_dataset_from_blocks(self.FV,
+                                                       [trigger_blocks[d] for d in documents],
+                                                       [argument_blocks[d] for d in documents])
+                     for documents in self.documents(i))
+
+    def run(self, clf = 'nb', mode = 'Trigger', n_workers = None, seed = None, **params):
+        """
+        train and evaluate clf on all folds, on n_workers processes (None: one
+        per fold). params are passed on to the evaluate_* function of clf.
+        Returns the mean of every measure over the folds, as
+        assignment2.crossvalidation.
+        """
+        global _task
+        evaluate_fold = {'nb': evaluate_nb, 'perc': evaluate_perceptron,
+                         'joint': evaluate_joint}[clf]
+        #featurize before forking, the workers inherit the blocks
+        for store_mode in (['trigger', 'argument'] if clf == 'joint' else
+                           ['trigger' if mode == 'Trigger' else 'argument']):
+            self.blocks(store_mode)
+
+        n_workers = self.k if n_workers is None else max(1, min(n_workers, self.k))
+        _task = (self, evaluate_fold, mode, params, seed)
+        try:
+            if n_workers > 1:
+                pool = multiprocessing.Pool(n_workers)
+                try:
+                    fold_results = pool.map(_run_fold, range(self.k))
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                fold_results = map(_run_fold, range(self.k))
+        finally:
+            _task = None
+
+        result = defaultdict(list)
+        for fold_result in fold_results:
+            for x, y in fold_result.items():
+                result[x].append(y)
+        result.update((x, round(np.mean(y), 4)) for x, y in result.items())
+        return result
+
+
+def _label_list(FV, mode):
+    return FV.trigger_list if mode == 'Trigger' else FV.arguments_list
+
+
+# NaiveBayes on fold i, with the 'None' samples subsampled at rate r
+def evaluate_nb(folds, i, mode, r = 0.6, k = 1.0):
+    train, valid = folds.split(i, mode)
+    label_list = _label_list(folds.FV, mode)
+    y_train = [label_list[y] for y in train.labels]
+    rows, y_train = perceptron.subsample(range(len(train)), y_train, subsampling_rate = r)
+    NB = nb.NaiveBayes(k)
+    NB.train(train.subset(rows), np.asarray(y_train))
+    _, prec, rec, F1 = NB.evaluate(valid, np.asarray([label_list[y] for y in valid.labels]))
+    return {'prec': prec, 'rec': rec, 'F1': F1}
+
+
+# trigger or argument perceptron on fold i
+def evaluate_perceptron(folds, i, mode, T_max = 10, LR = 1.0, subs_rate = 0.8):
+    train, valid = folds.split(i, mode)
+    Lambda, _ = perceptron.train_perceptron(folds.FV, [], T_max, LR, mode, subs_rate,
+                                            data = train)
+    predictions, gold = perceptron.test_perceptron(folds.FV, Lambda, [], mode, data = valid)
+    errors = sum(1 for y1, y2 in zip(predictions, gold) if y1 != y2)
+    prec, rec, F1 = utils.evaluate(gold, predictions, folds.FV,
+                                   mode = 'Trigger' if mode == 'Trigger' else 'Arguments')
+    return {'error': errors/float(max(1, len(gold))), 'prec': prec, 'rec': rec, 'F1': F1}
+
+
+# joint perceptron on fold i; trigger measures end in _e, argument measures in _a
+def evaluate_joint(folds, i, mode, T_max = 10, LR = 1.0):
+    train, valid = folds.joint_split(i)
+    L_t, L_a, _, _ = jnt.train_perceptron_joint(folds.FV, [], T_max, LR, mode, plot = False,
+                                               data = train)
+    p_e, g_e, p_a, g_a = jnt.test_perceptron_joint(folds.FV, L_t, L_a, [], mode, data = valid)
+    pp_a = [y for sublist in p_a for y in sublist]
+    gg_a = [y for sublist in g_a for y in sublist]
+    result = {}
+    for suffix, predictions, gold, eval_mode in [('_e', p_e, g_e, 'Trigger'),
+                                                 ('_a', pp_a, gg_a, 'Arguments')]:
+        errors = sum(1 for y1, y2 in zip(predictions, gold) if y1 != y2)
+        prec, rec, F1 = utils.evaluate(gold, predictions, folds.FV, mode = eval_mode)
+        result.update({'error' + suffix: errors/float(max(1, len(gold))),
+                       'prec' + suffix: prec, 'rec' + suffix: rec, 'F1' + suffix: F1})
+    return result
+
+
+if 0:
+    #3-fold crossvalidation of all classifiers, every document featurized once
+    import feature_vector
+    FV = feature_vector.FeatureVector('joint')
+    folds = Folds(FV, utils.list_files(), k = 3)
+    print folds.run('nb', mode = 'Trigger', r = 0.8)
+    print folds.run('perc', mode = 'Argument', T_max = 10, LR = 1.0, subs_rate = 0.9)
+    print folds.run('joint', mode = 'Joint_constrained', T_max = 20, LR = 10.0)
@@ -0,0 +1,112 @@
+"""
+Contiguous in-memory dataset of binary feature rows. A whole split is kept in a
+few flat arrays instead of one sparse matrix object per candidate:
+
+- indices: int32 active feature ids of all rows, concatenated
+- offsets: row i has the features indices[offsets[i]:offsets[i+1]]
+- labels: int32 gold label id of every row (FV.trigger_list/FV.arguments_list)
+- groups (optional): group offsets over the rows, e.g. for the argument rows of
+  the joint model the arguments of event e are the rows groups[e]:groups[e+1].
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+import feature_store
+import parallel_extraction
+
+
+class Dataset(object):
+    def __init__(self, indices, offsets, labels, n_cols, groups = None):
+        self.indices = np.asarray(indices, dtype = np.int32)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.labels = np.asarray(labels, dtype = np.int32)
+        self.n_cols = n_cols
+        self.groups = None if groups is None else np.asarray(groups, dtype = np.int64)
+
+    def __len__(self):
+        return len(self.labels)
+
+    #active feature ids of row i
+    def active(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    #row i as a 1 x n_cols binary csr matrix
+    def row(self, i):
+        active = self.active(i)
+        return csr_matrix((np.ones(len(active), dtype = np.uint8), active,
+                           [0, len(active)]), shape = (1, self.n_cols))
+
+    #all rows as one binary csr matrix
+    def to_csr(self):
+        return csr_matrix((np.ones(len(self.indices), dtype = np.uint8), self.indices,
+                           self.offsets), shape = (len(self), self.n_cols))
+
+    def n_groups(self):
+        return len(self.groups) - 1
+
+    #row numbers of group g
+    def group(self, g):
+        return range(self.groups[g], self.groups[g+1])
+
+    #new dataset of the given rows, in the given order (groups are dropped)
+    def subset(self, rows):
+        rows = np.asarray(rows, dtype = np.int64)
+        lengths = self.offsets[rows+1] - self.offsets[rows]
+        offsets = np.zeros(len(rows)+1, dtype = np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        if len(rows):
+            indices = np.concatenate([self.active(i) for i in rows])
+        else:
+            indices = np.zeros(0, dtype = np.int32)
+        return Dataset(indices, offsets, self.labels[rows], self.n_cols)
+
+    @classmethod
+    def from_csr(cls, X, labels, groups = None):
+        X = X.tocsr()
+        return cls(X.indices, X.indptr, labels, X.shape[1], groups)
+
+    #concatenate feature_store.FeatureBlocks (one per document)
+    @classmethod
+    def from_blocks(cls, blocks, n_cols, groups = None):
+        X, labels, _ = feature_store.stack_blocks(blocks, n_cols)
+        return cls(X.indices, X.indptr, labels, n_cols, groups)
+
+
+# feature blocks of all files in mode ('trigger' or 'argument'): from a
+# feature_store.FeatureStore if given, otherwise featurized on n_jobs processes.
+def _document_blocks(FV, file_list, mode, n_jobs = 1, store = None):
+    if store is not None:
+        return [feature_store.FeatureBlock.load(block_file) for block_file
+                in store.fill(file_list, mode, n_jobs = n_jobs)]
+    return parallel_extraction.map_documents(feature_store.featurize_document, file_list,
+                                             FV, args = (mode,), n_jobs = n_jobs)
+
+
+# Dataset of all candidates in file_list, mode 'Trigger' or 'Argument'.
+def load_dataset(FV, file_list, mode, n_jobs = 1, store = None):
+    store_mode = 'trigger' if mode == 'Trigger' else 'argument'
+    n_cols = FV.dim_trigger if mode == 'Trigger' else FV.dim_argument
+    blocks = _document_blocks(FV, file_list, store_mode, n_jobs, store)
+    return Dataset.from_blocks(blocks, n_cols)
+
+
+# (trigger Dataset, argument Dataset) of all event candidates in file_list for
+# the joint model. The arguments of event e (row e of the trigger Dataset) are
+# the rows of group e of the argument Dataset.
+def load_joint_dataset(FV, file_list, n_jobs = 1, store = None):
+    trigger_blocks = _document_blocks(FV, file_list, 'trigger', n_jobs, store)
+    argument_blocks = _document_blocks(FV, file_list, 'argument', n_jobs, store)
+    return joint_dataset_from_blocks(FV, trigger_blocks, argument_blocks)
+
+
+# joint (trigger Dataset, argument Dataset) of the trigger and argument blocks
+# of the same documents, in the same order
+def joint_dataset_from_blocks(FV, trigger_blocks, argument_blocks):
+    #(minlength must be positive for documents without event candidates)
+    n_arguments = [np.bincount(a.groups, minlength = max(1, len(t)))[:len(t)]
+                   for t, a in zip(trigger_blocks, argument_blocks)]
+    groups = np.zeros(sum(len(t) for t in trigger_blocks)+1, dtype = np.int64)
+    if len(groups) > 1:
+        groups[1:] = np.cumsum(np.concatenate(n_arguments))
+    return (Dataset.from_blocks(trigger_blocks, FV.dim_trigger),
+            Dataset.from_blocks(argument_blocks, FV.dim_argument, groups))
@@ -0,0 +1,160 @@
+"""
+Compiled feature space: all vocabularies, cutoffs and template offsets that
+define the layout of the feature vectors. It is built from the corpus once,
+saved to feature_space.data and reloaded by FeatureVector in milliseconds. It
+is only rebuilt when the corpus, the cutoffs or the feature templates change.
+"""
+
+import os
+import hashlib
+import cPickle
+import utils
+import corpus_stats
+from vocabulary import Vocabulary
+
+
+FORMAT_VERSION = 1
+FEATURE_SPACE_FILE = 'feature_space.data'
+DEFAULT_CUTOFFS = {'stem_trigger': 5, 'stem_argument': 5, 'mod_trigger': 25,
+                   'trig2arg_dep': 2}
+
+
+class FeatureSpace(object):
+    def __init__(self, vocabularies, cutoffs, template_dims, corpus_fingerprint):
+        """
+        vocabularies: dict FeatureVector attribute name -> Vocabulary
+        cutoffs: dict, see DEFAULT_CUTOFFS
+        template_dims: FeatureVector.template_dims the layout was computed for
+        corpus_fingerprint: corpus_fingerprint() of the files it was built from
+        """
+        self.vocabularies = vocabularies
+        self.cutoffs = dict(cutoffs)
+        self.template_dims = dict(template_dims)
+        self.corpus_fingerprint = corpus_fingerprint
+
+        #column offset of every template, and total dimension per mode
+        self.offsets = {}
+        self.dims = {}
+        for mode in ['trigger', 'argument']:
+            d = 0
+            for name in sorted(n for n in template_dims if n.startswith('phi_' + mode)):
+                self.offsets[name] = d
+                d += self.template_dim(name)
+            self.dims[mode] = d
+
+        #version of the feature space: changes whenever any column changes.
+        h = hashlib.sha1(str(FORMAT_VERSION))
+        for name in sorted(vocabularies):
+            h.update(_utf8(name))
+            for item in vocabularies[name]:
+                h.update('\0' + _utf8(item))
+        h.update(repr(sorted(self.offsets.items())))
+        self.key = h.hexdigest()
+
+    def template_dim(self, name):
+        dim = self.template_dims[name]
+        if isinstance(dim, str):
+            dim = len(self.vocabularies[dim])
+        return dim
+
+    #does this feature space still fit the requested settings and corpus?
+    #A missing corpus (fingerprint None) can't be checked and is accepted.
+    def is_valid(self, cutoffs, template_dims, corpus_fingerprint):
+        return (self.cutoffs == cutoffs and self.template_dims == template_dims
+                and (corpus_fingerprint is None
+                     or corpus_fingerprint == self.corpus_fingerprint))
+
+    def save(self, file_name = FEATURE_SPACE_FILE):
+        savedata = {'version': FORMAT_VERSION,
+                    'key': self.key,
+                    'vocabularies': dict((name, list(v)) for name, v
+                                         in self.vocabularies.items()),
+                    'cutoffs': self.cutoffs,
+                    'template_dims': self.template_dims,
+                    'corpus_fingerprint': self.corpus_fingerprint}
+        with open(file_name, 'wb') as f:
+            cPickle.dump(savedata, f, cPickle.HIGHEST_PROTOCOL)
+
+    #returns None if the file was written by another format version or is corrupt
+    @classmethod
+    def load(cls, file_name = FEATURE_SPACE_FILE):
+        with open(file_name, 'rb') as f:
+            loaded = cPickle.load(f)
+        if loaded.get('version') != FORMAT_VERSION:
+            return None
+        vocabularies = dict((name, Vocabulary(items)) for name, items
+                            in loaded['vocabularies'].items())
+        space = cls(vocabularies, loaded['cutoffs'], loaded['template_dims'],
+                    loaded['corpus_fingerprint'])
+        if space.key != loaded['key']:
+            return None
+        return space
+
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+# cheap fingerprint of the corpus: names, sizes and modification times of all
+# files. Returns None if there are no files to check against.
+def corpus_fingerprint(file_list):
+    if not file_list:
+        return None
+    h = hashlib.sha1()
+    for file_name in sorted(file_list):
+        stat = os.stat(file_name)
+        h.update('%s\0%d\0%d\n' % (os.path.basename(file_name), stat.st_size,
+                                  int(stat.st_mtime)))
+    return h.hexdigest()
+
+
+# compute all vocabularies in one pass over the corpus. They extend the presaved
+# vocabulary files in their saved order, so the columns of the pretrained
+# weights stay where they are; the files themselves are not written (see
+# corpus_stats.write_vocabularies). Without a corpus, the presaved vocabulary
+# files are used as they are.
+def build_feature_space(template_dims, cutoffs = DEFAULT_CUTOFFS, file_list = None,
+                        n_jobs = None):
+    if file_list is None:
+        file_list = utils.list_files()
+    if file_list:
+        vocabularies = corpus_stats.compute_vocabularies(cutoffs, file_list, n_jobs)
+        del vocabularies['mod_list_total']
+    else:
+        vocabularies = {
+            'all_grammar_tags': utils.get_grammar_tag_list(load = True),
+            'trigger_list': utils.get_trigger_list(load = True),
+            'dep_list_total': utils.identify_all_dep_labels(load = True),
+            'stem_list_triggers': utils.create_stem_list_trigger(load = True),
+            'stem_list_arguments': utils.create_stem_list_arguments(load = True),
+            'mod_list_triggers': utils.create_mod_list_trigger(load = True),
+            'trig2arg_deps': utils.create_dep_list_trig2arg(load = True),
+        }
+    vocabularies['arguments_list'] = [u'None', u'Theme', u'Cause']
+    vocabularies = dict((name, Vocabulary(v)) for name, v in vocabularies.items())
+    return FeatureSpace(vocabularies, cutoffs, template_dims,
+                        corpus_fingerprint(file_list))
+
+
+# load the compiled feature space, rebuilding it if it is missing or stale.
+def load_feature_space(cutoffs = None, template_dims = None, file_list = None,
+                       file_name = FEATURE_SPACE_FILE, n_jobs = None):
+    if template_dims is None:
+        from feature_vector import FeatureVector
+        template_dims = FeatureVector.template_dims
+    cutoffs = dict(DEFAULT_CUTOFFS, **(cutoffs or {}))
+    if file_list is None:
+        file_list = utils.list_files()
+    fingerprint = corpus_fingerprint(file_list)
+
+    if os.path.exists(file_name):
+        space = FeatureSpace.load(file_name)
+        if space is not None and space.is_valid(cutoffs, template_dims, fingerprint):
+            return space
+
+    print 'Compiling feature space.'
+    space = build_feature_space(template_dims, cutoffs, file_list, n_jobs)
+    space.save(file_name)
+    return space
@@ -0,0 +1,187 @@
+"""
+On-disk feature store with one block of features per json file and mode
+('trigger' or 'argument'). A block is keyed by the sha1 of the file content (for
+a columnar_corpus.ColumnarDocument: of its name and the fingerprint of its
+corpus) and the key of the feature space, so it never goes stale: changed files
+or feature spaces simply get new blocks. Any train/valid/test split or crossvalidation fold
+is assembled from the cached blocks without running the phi_* templates again.
+
+Every block is a single int32 .npy file that is memory-mapped on loading:
+    [n_rows, nnz, n_cols, indptr (n_rows+1), indices (nnz), labels (n_rows),
+     groups (n_rows)]
+indptr/indices are the CSR structure of the binary feature rows, labels the gold
+label ids (FV.trigger_list or FV.arguments_list) and groups the index of the
+event candidate within the document that each row belongs to.
+"""
+
+import os
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
+import columnar_corpus
+import parallel_extraction
+
+
+FEATURE_STORE_DIR = 'feature_store'
+MODES = ['trigger', 'argument']
+
+
+"""
+Features and labels of all candidates of one document in one mode.
+"""
+class FeatureBlock(object):
+    def __init__(self, indptr, indices, labels, groups, n_cols):
+        self.indptr = indptr
+        self.indices = indices
+        self.labels = labels
+        self.groups = groups
+        self.n_cols = n_cols
+
+    def __len__(self):
+        return len(self.labels)
+
+    #binary feature matrix, one row per candidate
+    def to_csr(self):
+        return csr_matrix((np.ones(len(self.indices), dtype = np.uint8),
+                           self.indices, self.indptr), shape = (len(self), self.n_cols))
+
+    def save(self, file_name):
+        n_rows = len(self.labels)
+        header = np.array([n_rows, len(self.indices), self.n_cols], dtype = np.int32)
+        data = np.concatenate([header, self.indptr, self.indices, self.labels, self.groups])
+        #write to a temporary file first, so that readers never see half a block
+        tmp_name = '%s.%d.tmp' % (file_name, os.getpid())
+        with open(tmp_name, 'wb') as f:
+            np.save(f, data.astype(np.int32))
+        os.rename(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        data = np.load(file_name, mmap_mode = 'r')
+        n_rows, nnz, n_cols = [int(i) for i in data[:3]]
+        a = 3
+        indptr = data[a:a+n_rows+1]; a += n_rows+1
+        indices = data[a:a+nnz]; a += nnz
+        labels = data[a:a+n_rows]; a += n_rows
+        groups = data[a:a+n_rows]
+        return cls(indptr, indices, labels, groups, n_cols)
+
+
+# featurize one document (json file name or columnar document) in mode.
+def featurize_document(document, FV, mode):
+    rows = []
+    labels = []
+    groups = []
+    event = 0
+    for sentence, events in columnar_corpus.iter_sentences(document):
+        for token_index, gold, arguments in events:
+            if mode == 'trigger':
+                rows.append( FV.get_feature_indices(token_index, sentence) )
+                labels.append( FV.trigger_list.index(gold) )
+                groups.append( event )
+            else:
+                for arg_index, arg_gold in arguments:
+                    rows.append( FV.get_feature_indices_argument_prediction(
+                                    token_index, arg_index, sentence) )
+                    labels.append( FV.arguments_list.index(arg_gold) )
+                    groups.append( event )
+            event += 1
+
+    indptr = np.zeros(len(rows)+1, dtype = np.int32)
+    indptr[1:] = np.cumsum([len(r) for r in rows])
+    if rows:
+        indices = np.concatenate(rows).astype(np.int32)
+    else:
+        indices = np.zeros(0, dtype = np.int32)
+    n_cols = FV.dim_trigger if mode == 'trigger' else FV.dim_argument
+    return FeatureBlock(indptr, indices, np.array(labels, dtype = np.int32),
+                        np.array(groups, dtype = np.int32), n_cols)
+
+
+# sha1 of the content of a file
+def content_hash(file_name):
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# key of a document (json file name or columnar document): the sha1 of the
+# file content, or of the document name and the fingerprint of its corpus
+def document_key(document):
+    if isinstance(document, columnar_corpus.ColumnarDocument):
+        h = hashlib.sha1('columnar\0' + document.corpus.fingerprint())
+        h.update('\0' + document.name.encode('utf-8'))
+        return h.hexdigest()
+    return content_hash(document)
+
+
+"""
+Per-document feature cache for the feature space of FV.
+"""
+class FeatureStore(object):
+    def __init__(self, FV, directory = FEATURE_STORE_DIR):
+        self.FV = FV
+        self.directory = os.path.join(directory, FV.feature_space.key[:16])
+        for mode in MODES:
+            path = os.path.join(self.directory, mode)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def block_file(self, file_name, mode):
+        return os.path.join(self.directory, mode, document_key(file_name) + '.npy')
+
+    #features of json file (or columnar document) file_name in mode; computed
+    #and cached if missing.
+    def block(self, file_name, mode, refresh = False):
+        block_file = self.block_file(file_name, mode)
+        if refresh or not os.path.exists(block_file):
+            featurize_document(file_name, self.FV, mode).save(block_file)
+        return FeatureBlock.load(block_file)
+
+    #compute and cache the blocks of all files (or columnar documents) in
+    #file_list that are missing, on n_jobs worker processes (None: all cores).
+    def fill(self, file_list, mode, refresh = False, n_jobs = 1):
+        block_files = [self.block_file(file_name, mode) for file_name in file_list]
+        missing = [(file_name, block_file) for file_name, block_file
+                   in zip(file_list, block_files) if refresh or not os.path.exists(block_file)]
+        blocks = parallel_extraction.map_documents(featurize_document, 
+                                                   [file_name for file_name, _ in missing], 
+                                                   self.FV, args = (mode,), n_jobs = n_jobs)
+        for (_, block_file), block in zip(missing, blocks):
+            block.save(block_file)
+        return block_files
+
+    #stack the blocks of all files: returns a binary csr matrix X and the
+    #gold label ids y (and the per-row document indices, if return_documents)
+    def assemble(self, file_list, mode, refresh = False, return_documents = False, 
+                 n_jobs = 1):
+        block_files = self.fill(file_list, mode, refresh, n_jobs)
+        blocks = [FeatureBlock.load(block_file) for block_file in block_files]
+        X, y, documents = stack_blocks(blocks,
+                              self.FV.dim_trigger if mode == 'trigger' else self.FV.dim_argument)
+        if return_documents:
+            return X, y, documents
+        return X, y
+
+
+# concatenate feature blocks into one csr matrix, label array and the index of
+# the block every row came from.
+def stack_blocks(blocks, n_cols):
+    n_rows = sum(len(b) for b in blocks)
+    nnz = sum(len(b.indices) for b in blocks)
+    indptr = np.zeros(n_rows+1, dtype = np.int64)
+    indices = np.empty(nnz, dtype = np.int32)
+    labels = np.empty(n_rows, dtype = np.int32)
+    documents = np.empty(n_rows, dtype = np.int32)
+    r = 0
+    for i, b in enumerate(blocks):
+        n = len(b)
+        indptr[r+1:r+n+1] = indptr[r] + b.indptr[1:]
+        indices[indptr[r]:indptr[r+n]] = b.indices
+        labels[r:r+n] = b.labels
+        documents[r:r+n] = i
+        r += n
+    X = csr_matrix((np.ones(nnz, dtype = np.uint8), indices, indptr), shape = (n_rows, n_cols))
+    return X, labels, documents
@@ -1,270 +1,265 @@
 import numpy as np
 import string
-from scipy.sparse import coo_matrix
-import utils
+from scipy.sparse import csr_matrix
 import inspect
+from feature_space import load_feature_space
+from collections import defaultdict
+from itertools import chain
+
+
+#feature id of every character in the character indicator templates
+CHARACTER_IDS = dict((character, i) for i, character in enumerate(string.printable))
+
+
+"""
+Per-sentence index of the json sentence, built once and shared by all
+candidates of that sentence so that the templates don't rescan the raw lists.
+"""
+class SentenceIndex():
+    def __init__(self, words, pos_tags, stems, deps, mentions):
+        """
+        words, pos_tags, stems: one string per token
+        deps: (head, mod, label) triples; mentions: (begin, end) token ranges
+        """
+        self.words = words
+        self.pos_tags = pos_tags
+        self.stems = stems
+
+        #adjacency: head -> (mod, label), mod -> (head, label), (head, mod) -> labels
+        self.head_deps = defaultdict(list)
+        self.mod_deps = defaultdict(list)
+        self.pair_labels = defaultdict(list)
+        for head, mod, label in deps:
+            self.head_deps[head].append( (mod, label) )
+            self.mod_deps[mod].append( (head, label) )
+            self.pair_labels[(head, mod)].append(label)
+
+        #bitmap: is the token part of a (protein) mention?
+        self.in_mention = np.zeros(len(words), dtype = bool)
+        for begin, end in mentions:
+            self.in_mention[begin:end] = True
+
+    @classmethod
+    def from_json(cls, sentence):
+        tokens = sentence['tokens']
+        return cls([token['word'] for token in tokens],
+                   [token['pos'] for token in tokens],
+                   [token['stem'] for token in tokens],
+                   [(dep['head'], dep['mod'], dep['label']) for dep in sentence['deps']],
+                   [(mention['begin'], mention['end']) for mention in sentence['mentions']])
+
 
 """
 Class for feature vectors.
 """
 class FeatureVector():
+    # Dimension of every feature template: either a fixed size or the name of
+    # the vocabulary attribute whose entries the template indicates.
+    template_dims = {
+        'phi_trigger_0': len(string.printable),
+        'phi_trigger_1': 'all_grammar_tags',
+        'phi_trigger_2': 'stem_list_triggers',
+        'phi_trigger_3': 'dep_list_total',
+        'phi_trigger_4': 'dep_list_total',
+        'phi_trigger_5': 'mod_list_triggers',
+        'phi_argument_0': 1,
+        'phi_argument_1': 'all_grammar_tags',
+        'phi_argument_2': 'all_grammar_tags',
+        'phi_argument_3': 'stem_list_triggers',
+        'phi_argument_4': 'stem_list_arguments',
+        'phi_argument_5': len(string.printable),
+        'phi_argument_6': 'dep_list_total',
+        'phi_argument_7': 'dep_list_total',
+        'phi_argument_8': 'trig2arg_deps',
+    }
+
     # this extended dictionary class is initialised by passing a list of functions to it. These are then assigned as dictionary items upon init.
-    def __init__(self, mode = 'argument'):
+    def __init__(self, mode = 'argument', feature_space = None):
+        """
+        feature_space: a compiled feature_space.FeatureSpace. Loaded from
+        feature_space.data (and rebuilt there if stale) when not given.
+        """
         if mode not in ['argument', 'trigger', 'joint']:
             print 'ERROR, wrong mode of calling FeatureVector class! '
 
         #get handles to all phi functions
         self.methods = inspect.getmembers(self, predicate=inspect.ismethod)
         self.mode = mode
-        if self.mode == 'argument' or self.mode == 'trigger':
-            self.phi_list = [method[1] for method in self.methods if 'phi_'+mode in method[0]]
-        elif mode == 'joint':
-            self.phi_list_arg = [method[1] for method in self.methods if 'phi_argument' in method[0]]
-            self.phi_list_trig = [method[1] for method in self.methods if 'phi_trigger' in method[0]]
-
-        #load relevant other data from presaved files.
-        self.listOfAllFiles = utils.list_files()
-        self.all_grammar_tags = utils.get_grammar_tag_list()
-        self.trigger_list = utils.get_trigger_list()
-
-        self.stem_list_triggers = utils.create_stem_list_trigger(cutoff = 5, load=True)
-        self.stem_list_arguments = utils.create_stem_list_arguments(cutoff = 5, load=True)
-        self.mod_list_triggers = utils.create_mod_list_trigger(cutoff = 25, load=False)
-        self.arguments_list = [u'None', u'Theme', u'Cause']
+        self.phi_list_arg = [method[1] for method in self.methods if 'phi_argument' in method[0]]
+        self.phi_list_trig = [method[1] for method in self.methods if 'phi_trigger' in method[0]]
+        if self.mode == 'argument':
+            self.phi_list = self.phi_list_arg
+        elif self.mode == 'trigger':
+            self.phi_list = self.phi_list_trig
+
+        #vocabularies and template layout from the compiled feature space.
+        if feature_space is None:
+            feature_space = load_feature_space(template_dims = self.template_dims)
+        self.feature_space = feature_space
+        vocabularies = feature_space.vocabularies
+        self.all_grammar_tags = vocabularies['all_grammar_tags']
+        self.trigger_list = vocabularies['trigger_list']
+
+        self.stem_list_triggers = vocabularies['stem_list_triggers']
+        self.stem_list_arguments = vocabularies['stem_list_arguments']
+        self.mod_list_triggers = vocabularies['mod_list_triggers']
+        self.arguments_list = vocabularies['arguments_list']
         
-        self.dep_list_total = utils.identify_all_dep_labels(load = True) 
-        self.trig2arg_deps = utils.create_dep_list_trig2arg(cutoff = 2, load = True)
+        self.dep_list_total = vocabularies['dep_list_total']
+        self.trig2arg_deps = vocabularies['trig2arg_deps']
+
+        #column offset of every template in the feature row
+        self.templates_trig = [(phi, feature_space.offsets[phi.__name__]) for phi in self.phi_list_trig]
+        self.templates_arg = [(phi, feature_space.offsets[phi.__name__]) for phi in self.phi_list_arg]
+        self.dim_trigger = feature_space.dims['trigger']
+        self.dim_argument = feature_space.dims['argument']
 
+        self._last_sentence = None
+        self._last_sentence_index = None
 
-    #Feature matrix for trigger prediction
-    def get_feature_matrix(self, token_index, sentence, clf):
+
+    #Feature matrix for trigger prediction: a single row of features for the
+    #candidate, shared by all classes. The class only enters through the row
+    #of the weight matrix it is multiplied with, see perceptron_sketch.predict
+    def get_feature_matrix(self, token_index, sentence, clf = None):
         """
-        clf (string): 'nb' or 'perc'
+        clf (string): 'nb' or 'perc'. Both classifiers use the same 1 x d row,
+        the argument is kept for backwards compatibility only.
         """
-        all_col_indices = []
-        all_row_indices = []
-        values = []
-        if clf == 'nb':
-            n_classes = 1  #length of list of all occurring triggers in dataset.
-        elif clf == 'perc':
-            n_classes = 10
-        for c in range(n_classes):
-            d=0
-            for phi in self.phi_list:
-                phi_vector = phi(token_index, sentence)
-    
-                index = list(np.nonzero(np.array(phi_vector))[0])
-                all_col_indices += [i+d for i in index]    # offset d in matrix                
-                all_row_indices += [c]*len(index)
-                
-                values += list(np.array(phi_vector)[index])
-                
-                d += len(phi_vector)
-             
-        
-        sparse_feature_matrix = coo_matrix((np.array(values), 
-                                           (np.asarray(all_row_indices),
-                                            np.array(all_col_indices) ) ),
-                                            shape=(n_classes,d))
-            
-        return sparse_feature_matrix
+        indices = self.get_feature_indices(token_index, sentence)
+        return self._binary_row(indices, self.dim_trigger)
 
     
     #Get feature matrix for argument prediction: for pairs of tokens and 
     #argument candidates. Otherwise same skeleton as "get_feature_matrix()"
-    def get_feature_matrix_argument_prediction(self, token_index, arg_index, sentence, clf):
-        all_col_indices = []
-        all_row_indices = []
-        values = []
-        if clf == 'nb':
-            n_classes = 1
-        elif clf == 'perc':
-            n_classes = 3
-        for c in range(n_classes):
-            d=0
-            for phi in self.phi_list:
-                phi_vector = phi(token_index, arg_index, sentence)
-                index = list(np.nonzero(np.array(phi_vector))[0])
-                all_col_indices += [i+d for i in index]    # offset d in matrix                
-                all_row_indices += [c]*len(index)
-                
-                values += list(np.array(phi_vector)[index])
-                
-                d += len(phi_vector)
-             
-        
-        sparse_feature_matrix = coo_matrix((np.array(values), 
-                                           (np.asarray(all_row_indices),
-                                            np.array(all_col_indices) ) ),
-                                            shape=(n_classes,d))
-            
-        return sparse_feature_matrix
-    
-    
-    
+    def get_feature_matrix_argument_prediction(self, token_index, arg_index, sentence, clf = None):
+        indices = self.get_feature_indices_argument_prediction(token_index, arg_index, sentence)
+        return self._binary_row(indices, self.dim_argument)
+
+
+    #active (=1) feature columns of a trigger candidate, as int32 array.
+    def get_feature_indices(self, token_index, sentence):
+        sentence = self.get_sentence_index(sentence)
+        active = chain.from_iterable(
+            [offset + i for i in phi(token_index, sentence)] 
+            for phi, offset in self.templates_trig)
+        return np.fromiter(active, dtype = np.int32)
+
+
+    #active (=1) feature columns of a trigger-argument pair, as int32 array.
+    def get_feature_indices_argument_prediction(self, token_index, arg_index, sentence):
+        sentence = self.get_sentence_index(sentence)
+        active = chain.from_iterable(
+            [offset + i for i in phi(token_index, arg_index, sentence)] 
+            for phi, offset in self.templates_arg)
+        return np.fromiter(active, dtype = np.int32)
+
+
+    #all features are binary: wrap active columns into a sparse 1 x d row.
+    def _binary_row(self, indices, d):
+        return csr_matrix((np.ones(len(indices), dtype = np.uint8), indices,
+                           np.array([0, len(indices)], dtype = np.int32)), 
+                           shape=(1,d))
+
+
+    #return the SentenceIndex for a json sentence. Candidates of one sentence
+    #come in one after the other, so the index of the last sentence is cached.
+    def get_sentence_index(self, sentence):
+        if isinstance(sentence, SentenceIndex):
+            return sentence
+        if sentence is not self._last_sentence:
+            self._last_sentence = sentence
+            self._last_sentence_index = SentenceIndex.from_json(sentence)
+        return self._last_sentence_index
+
+
     # feature templates take as input a token_index and sentence (which is
-    # a sentence from the json dictionary, containing all information about grammar
-    # tags, links and relations to other tokens, their positions, and finally
-    # also the gold labels for both triggers and arguments.) Note that the token
-    # is not a string, but the index at which this token appears in sentence.
+    # the SentenceIndex of a sentence from the json dictionary, giving access to
+    # the words, grammar tags and stems of all tokens, and their dependencies and
+    # mentions). Note that the token is not a string, but the index at which this
+    # token appears in sentence. All features are binary: every template returns
+    # the sorted ids of its active features, counted from 0 up to its dimension
+    # in template_dims.
     """TRIGGER FEATURES"""
 
     def phi_trigger_0(self, token_index, sentence):
         #character indicator
-        token = sentence['tokens'][token_index]['word']
-        symbols_list = string.printable
-        return_vec = [ np.uint8(character in token)  for character in symbols_list]
-        return return_vec
+        token = sentence.words[token_index]
+        return sorted(CHARACTER_IDS[c] for c in set(token) if c in CHARACTER_IDS)
 
     def phi_trigger_1(self, token_index, sentence):
         #grammar (pos)-tag indicator
-        observed_grammar_tag = sentence['tokens'][token_index]['pos'] #e.g. 'NN'
-        index = self.all_grammar_tags.index(observed_grammar_tag)
-
-        unit_vec = np.zeros(len(self.all_grammar_tags), dtype = np.uint8)
-        unit_vec[index] = 1.0
-        return list(unit_vec)
+        observed_grammar_tag = sentence.pos_tags[token_index] #e.g. 'NN'
+        return [self.all_grammar_tags.index(observed_grammar_tag)]
 
     def phi_trigger_2(self, token_index, sentence):
         #evaluate stem of token.
-        observed_stem = sentence['tokens'][token_index]['stem']
-        unit_vec = np.zeros(len(self.stem_list_triggers), dtype = np.uint8)
-
-        if observed_stem in self.stem_list_triggers:
-            index = self.stem_list_triggers.index(observed_stem)
-            unit_vec[index] = 1.0
-        return list(unit_vec)
+        index = self.stem_list_triggers.get(sentence.stems[token_index])
+        return [] if index is None else [index]
 
     def phi_trigger_3(self, token_index, sentence):
-        #evaluate head of token.
-        dep_vec = np.zeros(len(self.dep_list_total), dtype = np.uint8)
-
-        #return a vector with 1 for the dep_label for which the token is head.
-        for dep in sentence['deps']:
-            if dep['head'] == token_index:
-                dep_label = dep['label']
-                if dep_label in self.dep_list_total:
-                    index = self.dep_list_total.index(dep_label)
-                    dep_vec[index] = 1.0
-        return list(dep_vec)
+        #evaluate head of token: the dep_labels for which the token is head.
+        labels = set(label for _, label in sentence.head_deps[token_index])
+        return self._lookup_all(self.dep_list_total, labels)
 
     def phi_trigger_4(self, token_index, sentence):
-        #evaluate mod of token.
-        dep_vec = np.zeros(len(self.dep_list_total), dtype = np.uint8)
-
-        #return a vector with 1 for the dep_label for which the token is mod.
-        for dep in sentence['deps']:
-            if dep['mod'] == token_index:
-                dep_label = dep['label']
-                if dep_label in self.dep_list_total:
-                    index = self.dep_list_total.index(dep_label)
-                    dep_vec[index] = 1.0
-        return list(dep_vec)
+        #evaluate mod of token: the dep_labels for which the token is mod.
+        labels = set(label for _, label in sentence.mod_deps[token_index])
+        return self._lookup_all(self.dep_list_total, labels)
 
     def phi_trigger_5(self, token_index, sentence):
-        #evaluate head of token.
-        mod_vec = np.zeros(len(self.mod_list_triggers), dtype = np.uint8)
-
-        #return a vector with 1 for the mods for which the token is head.
-        for dep in sentence['deps']:
-            if dep['head'] == token_index:
-                mod = sentence['tokens'][dep['mod']]
-                if mod in self.mod_list_triggers:
-                    index = self.mod_list_triggers.index(mod)
-                    mod_vec[index] = 1.0
-        return list(mod_vec)
+        #evaluate head of token: the mods for which the token is head.
+        mods = set(sentence.words[mod_index] for mod_index, _ in sentence.head_deps[token_index])
+        return self._lookup_all(self.mod_list_triggers, mods)
         
 
     """ARGUMENT FEATURES"""
     def phi_argument_0(self, token_index, arg_index, sentence):
         #extract if argument is a protein   (Mentions)
-        protein = [0]
-        for mention in sentence['mentions']:
-            if arg_index >= mention['begin'] and arg_index < mention['end']:
-                protein = [1]
-        return protein
+        return [0] if sentence.in_mention[arg_index] else []
 
     def phi_argument_1(self, token_index, arg_index, sentence):
         #evaluate grammar pos tag of argument
-        observed_grammar_tag = sentence['tokens'][arg_index]['pos']
-        index = self.all_grammar_tags.index(observed_grammar_tag)
-
-        unit_vec = np.zeros(len(self.all_grammar_tags), dtype = np.uint8)
-        unit_vec[index] = 1.0
-        return list(unit_vec)
+        observed_grammar_tag = sentence.pos_tags[arg_index]
+        return [self.all_grammar_tags.index(observed_grammar_tag)]
 
     def phi_argument_2(self, token_index, arg_index, sentence):
         #evaluate grammar pos tag of trigger token
-        observed_grammar_tag = sentence['tokens'][token_index]['pos']
-        index = self.all_grammar_tags.index(observed_grammar_tag)
-
-        unit_vec = np.zeros(len(self.all_grammar_tags), dtype = np.uint8)
-        unit_vec[index] = 1.0
-        return list(unit_vec)
+        observed_grammar_tag = sentence.pos_tags[token_index]
+        return [self.all_grammar_tags.index(observed_grammar_tag)]
 
     def phi_argument_3(self, token_index, arg_index, sentence):
         #evaluate stem of trigger token.
-        observed_stem = sentence['tokens'][token_index]['stem']
-        unit_vec = np.zeros(len(self.stem_list_triggers), dtype = np.uint8)
-
-        if observed_stem in self.stem_list_triggers:
-            index = self.stem_list_triggers.index(observed_stem)
-            unit_vec[index] = 1.0
-        return list(unit_vec)
+        index = self.stem_list_triggers.get(sentence.stems[token_index])
+        return [] if index is None else [index]
 
     def phi_argument_4(self, token_index, arg_index, sentence):
         #evaluate stem of argument token.
-        observed_stem = sentence['tokens'][arg_index]['stem']
-        unit_vec = np.zeros(len(self.stem_list_arguments), dtype = np.uint8)
-
-        if observed_stem in self.stem_list_arguments:
-            index = self.stem_list_arguments.index(observed_stem)
-            unit_vec[index] = 1.0
-        return list(unit_vec)
-
+        index = self.stem_list_arguments.get(sentence.stems[arg_index])
+        return [] if index is None else [index]
 
     def phi_argument_5(self, token_index, arg_index, sentence):
         #character indicator for argument
-        token = sentence['tokens'][arg_index]['word']
-        symbols_list = string.printable
-        return_vec = [ np.uint8(character in token)  for character in symbols_list]
-        return return_vec
+        token = sentence.words[arg_index]
+        return sorted(CHARACTER_IDS[c] for c in set(token) if c in CHARACTER_IDS)
 
     def phi_argument_6(self, token_index, arg_index, sentence):
-        #evaluate head of arg_index.
-        dep_vec = np.zeros(len(self.dep_list_total), dtype = np.uint8)
-
-        #return a vector with 1 for the dep_label for which the token is head.
-        for dep in sentence['deps']:
-            if dep['head'] == arg_index:
-                dep_label = dep['label']
-                if dep_label in self.dep_list_total:
-                    index = self.dep_list_total.index(dep_label)
-                    dep_vec[index] = 1.0
-        return list(dep_vec)
+        #evaluate head of arg_index: the dep_labels for which the token is head.
+        labels = set(label for _, label in sentence.head_deps[arg_index])
+        return self._lookup_all(self.dep_list_total, labels)
 
     def phi_argument_7(self, token_index, arg_index, sentence):
-        #evaluate mod of arg_index.
-        dep_vec = np.zeros(len(self.dep_list_total), dtype = np.uint8)
-
-        #return a vector with 1 for the dep_label for which the token is mod.
-        for dep in sentence['deps']:
-            if dep['mod'] == arg_index:
-                dep_label = dep['label']
-                if dep_label in self.dep_list_total:
-                    index = self.dep_list_total.index(dep_label)
-                    dep_vec[index] = 1.0
-        return list(dep_vec)
+        #evaluate mod of arg_index: the dep_labels for which the token is mod.
+        labels = set(label for _, label in sentence.mod_deps[arg_index])
+        return self._lookup_all(self.dep_list_total, labels)
         
     def phi_argument_8(self, token_index, arg_index, sentence):
         #evaluate if trig--->arg dependency falls into one of the typical trig2arg_dep
-        dep_vec = np.zeros(len(self.trig2arg_deps), dtype = np.uint8)
-
-        #return a vector with 1 for the dep_label for which trig->arg has this label
-        for dep in sentence['deps']:
-            if dep['mod'] == token_index and dep['head'] == arg_index:
-                dep_label = dep['label']
-                if dep_label in self.trig2arg_deps:
-                    index = self.trig2arg_deps.index(dep_label)
-                    dep_vec[index] = 1.0
-        return list(dep_vec)
+        labels = set(sentence.pair_labels[(arg_index, token_index)])
+        return self._lookup_all(self.trig2arg_deps, labels)
+
+
+    #sorted ids of all entries of values that are in vocabulary
+    def _lookup_all(self, vocabulary, values):
+        ids = [vocabulary.get(value) for value in values]
+        return sorted(i for i in ids if i is not None)
@@ -0,0 +1,172 @@
+"""
+Batched constrained decoding for the joint perceptron. Instead of decoding one
+event candidate at a time (joint_perceptron.decode_constrained), all events of a
+document or split are decoded at once with array operations, from
+
+- trigger_scores: (n_events x n_trigger_classes) linear trigger scores
+- argument_scores: (n_arguments x n_argument_classes) linear argument scores of
+  the arguments of all events, stacked
+- groups: offsets of the arguments of every event, the arguments of event e
+  are the rows groups[e]:groups[e+1] (as in dataset.Dataset.groups).
+
+The three hypotheses of every event (None trigger, regulation trigger,
+non-regulation trigger), including the switch of the cheapest argument to Theme,
+are evaluated segment-wise and give the same labels as decode_constrained.
+"""
+
+import numpy as np
+import perceptron_sketch as perceptron
+import joint_perceptron
+
+
+# event number of every argument row
+def argument_events(groups):
+    return np.repeat(np.arange(len(groups)-1), np.diff(groups))
+
+
+# sum of x over the arguments of every event
+def segment_sum(x, events, n_events):
+    return np.bincount(events, weights = x, minlength = max(1, n_events))[:n_events]
+
+
+# best allowed class per row: argmax over the columns allowed_classes of scores
+# (first one on ties), as class ids
+def argmax_allowed(scores, allowed_classes):
+    allowed_classes = np.asarray(allowed_classes)
+    return allowed_classes[np.argmax(scores[:, allowed_classes], axis = 1)]
+
+
+# switch the cheapest argument of every event without a Theme argument to Theme
+# (see joint_perceptron.enforce_one_Theme). Changes labels in place.
+def enforce_one_Theme(labels, argument_scores, events, groups, Theme_argument):
+    n_events = len(groups)-1
+    rows = np.arange(len(labels))
+    has_Theme = segment_sum((labels == Theme_argument).astype(float), events, n_events) > 0
+    #cost of switching every argument to Theme
+    Delta = argument_scores[rows, labels] - argument_scores[rows, Theme_argument]
+    #per event, the first argument with the smallest Delta comes first
+    order = np.lexsort((rows, Delta, events))
+    nonempty = np.diff(groups) > 0
+    switch = order[groups[:-1][nonempty & ~has_Theme]]
+    labels[switch] = Theme_argument
+    return labels
+
+
+# constrained argmax for all events at once; classes from
+# joint_perceptron.constraint_classes. Returns the trigger label of every event
+# and the argument label of every argument row.
+def decode_constrained_batch(trigger_scores, argument_scores, groups, classes):
+    groups = np.asarray(groups)
+    n_events = len(groups)-1
+    events = argument_events(groups)
+    rows = np.arange(len(argument_scores))
+    Theme_argument = classes['Theme_argument']
+
+    #hypothesis 1: None trigger, all arguments None
+    e_1 = np.repeat(classes['None_trigger'], n_events)
+    a_1 = np.repeat(classes['None_argument'], len(argument_scores))
+
+    #hypothesis 2: regulation trigger, any argument labels
+    e_2 = argmax_allowed(trigger_scores, classes['Regulation_triggers'])
+    a_2 = np.argmax(argument_scores, axis = 1)
+    a_2 = enforce_one_Theme(a_2, argument_scores, events, groups, Theme_argument)
+
+    #hypothesis 3: other trigger, arguments None or Theme
+    e_3 = argmax_allowed(trigger_scores, classes['Other_triggers'])
+    a_3 = argmax_allowed(argument_scores, [classes['None_argument'], Theme_argument])
+    a_3 = enforce_one_Theme(a_3, argument_scores, events, groups, Theme_argument)
+
+    hypotheses = [(e_1, a_1), (e_2, a_2), (e_3, a_3)]
+    total_scores = np.array([trigger_scores[np.arange(n_events), e]
+                             + segment_sum(argument_scores[rows, a], events, n_events)
+                             for e, a in hypotheses])
+    #first best hypothesis of every event
+    best = np.argmax(total_scores, axis = 0)
+    e_hat = np.choose(best, [e for e, _ in hypotheses])
+    a_hat = np.choose(best[events], [a for _, a in hypotheses]) if len(events) else a_1
+    return e_hat, a_hat
+
+
+# best argument labels from allowed_classes with at least one Theme, by dynamic
+# programming over the arguments with the state "Theme seen yet". Returns the
+# labels and their total score; no arguments give ([], 0.0).
+def best_arguments_with_Theme(argument_scores, allowed_classes, Theme_argument):
+    N_arguments = len(argument_scores)
+    if N_arguments == 0:
+        return [], 0.0
+    other_classes = [c for c in allowed_classes if c != Theme_argument]
+    #state 0: no Theme so far, state 1: at least one Theme so far
+    score_0, score_1 = 0.0, -np.inf
+    best_other = []
+    from_state_0 = []   #did the best state 1 at argument j come from state 0?
+    for j in range(N_arguments):
+        o = max(other_classes, key = lambda c: argument_scores[j][c])
+        s_o, s_t = argument_scores[j][o], argument_scores[j][Theme_argument]
+        best_other.append(o)
+        via_1 = score_1 + max(s_o, s_t)
+        via_0 = score_0 + s_t
+        from_state_0.append(via_0 >= via_1)
+        score_1 = max(via_0, via_1)
+        score_0 = score_0 + s_o
+
+    #trace back from state 1 after the last argument
+    labels = [None]*N_arguments
+    state = 1
+    for j in reversed(range(N_arguments)):
+        if state == 0:
+            labels[j] = best_other[j]
+        elif from_state_0[j]:
+            labels[j] = Theme_argument
+            state = 0
+        elif argument_scores[j][Theme_argument] >= argument_scores[j][best_other[j]]:
+            labels[j] = Theme_argument
+        else:
+            labels[j] = best_other[j]
+    return labels, score_1
+
+
+# exact constrained argmax for one event: the highest scoring trigger label and
+# argument labels that satisfy the constraints of decode_constrained (None
+# trigger: all arguments None; regulation trigger: None/Theme/Cause arguments,
+# other triggers: None/Theme arguments; at least one Theme if the trigger is not
+# None and there are arguments). The argument part does not depend on which
+# trigger of a group is chosen, so the best trigger of each group plus the best
+# argument labels of that group is optimal. Linear in the number of arguments.
+def decode_exact(trigger_scores, argument_scores, classes):
+    N_arguments = len(argument_scores)
+    None_argument = classes['None_argument']
+    Theme_argument = classes['Theme_argument']
+    groups = [(classes['Regulation_triggers'],
+               [None_argument, Theme_argument, classes['Cause_argument']]),
+              (classes['Other_triggers'], [None_argument, Theme_argument])]
+
+    e_best = classes['None_trigger']
+    a_best = [None_argument]*N_arguments
+    s_best = trigger_scores[e_best] + sum(argument_scores[j][None_argument]
+                                          for j in range(N_arguments))
+    for trigger_classes, argument_classes in groups:
+        e = trigger_classes[int(np.argmax([trigger_scores[c] for c in trigger_classes]))]
+        a, s_a = best_arguments_with_Theme(argument_scores, argument_classes, Theme_argument)
+        if trigger_scores[e] + s_a > s_best:
+            e_best, a_best, s_best = e, a, trigger_scores[e] + s_a
+    return e_best, a_best
+
+
+# decode all events of a joint dataset (trigger Dataset, argument Dataset) in
+# mode 'Joint_unconstrained' or 'Joint_constrained'. Returns the trigger label
+# of every event and the list of argument labels of every event.
+def predict_joint_batch(FV, data, Lambda_trigger, Lambda_argument, mode):
+    trigger_data, argument_data = data
+    _, trigger_scores = perceptron.predict_batch(trigger_data.to_csr(), Lambda_trigger,
+                                                 return_scores = True)
+    _, argument_scores = perceptron.predict_batch(argument_data.to_csr(), Lambda_argument,
+                                                  return_scores = True)
+    groups = argument_data.groups
+    if mode == 'Joint_constrained':
+        e_hat, a_hat = decode_constrained_batch(trigger_scores, argument_scores, groups,
+                                                joint_perceptron.constraint_classes(FV))
+    else:
+        e_hat = np.argmax(trigger_scores, axis = 1)
+        a_hat = np.argmax(argument_scores, axis = 1)
+    a_hat = a_hat.tolist()
+    return e_hat.tolist(), [a_hat[groups[e]:groups[e+1]] for e in range(len(e_hat))]
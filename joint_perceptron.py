@@ -7,12 +7,16 @@ Created on Wed Dec 03 16:40:50 2014
 
 import utils
 import feature_vector
+import columnar_corpus
+import dataset
+import parallel_extraction
 import perceptron_sketch as perceptron
 
 import warnings
 import json
 import time
 import numpy as np
+from scipy.sparse import vstack
 import matplotlib.pyplot as plt
 import cPickle
 
@@ -79,54 +83,63 @@ def subsample_jointly(feature_tuples, gold_tuples, rate_trig, rate_arg):
 
 
 
-# prediction function for joint perceptron, using constraints
-def predict_under_constraint(feature_matrix, Lambda, allowed_classes, 
-                             return_scores = False):
-    scores = []
-    for c in allowed_classes:
-        scores.append( np.exp( feature_matrix.getrow(c).dot(Lambda[c,:])[0] ) )
-        
-    highest_score = max(scores)
-    predicted_class = scores.index(highest_score)
-    if not return_scores:
-        return predicted_class
+# class ids behind the constraints of the joint model
+def constraint_classes(FV):
+    Regulation_triggers = [i for i in range(len(FV.trigger_list)) \
+                               if 'egulation' in FV.trigger_list[i]]
+    return {'None_trigger': FV.trigger_list.index(u'None'),
+            'Regulation_triggers': Regulation_triggers,
+            'Other_triggers': [i for i in range(len(FV.trigger_list)) \
+                               if i not in Regulation_triggers 
+                               and FV.trigger_list[i] != u'None'],
+            'None_argument': FV.arguments_list.index(u'None'),
+            'Theme_argument': FV.arguments_list.index(u'Theme'),
+            'Cause_argument': FV.arguments_list.index(u'Cause')}
+
+
+# linear scores of one event candidate, computed once: the trigger score vector
+# (n_trigger_classes) and the argument score matrix (n_arguments x n_arg_classes)
+def event_scores(X_trigger, Lambda_trigger, X_arguments, Lambda_argument):
+    trigger_scores = np.asarray(X_trigger.dot(Lambda_trigger.T)).ravel()
+    if len(X_arguments):
+        argument_scores = np.asarray(vstack(X_arguments).dot(Lambda_argument.T))
     else:
-        return predicted_class, scores
+        argument_scores = np.zeros((0, Lambda_argument.shape[0]))
+    return trigger_scores, argument_scores
+
+
+# prediction function for joint perceptron, using constraints: the highest
+# scoring class among allowed_classes
+def predict_under_constraint(scores, allowed_classes):
+    allowed_scores = [scores[c] for c in allowed_classes]
+    return allowed_classes[allowed_scores.index(max(allowed_scores))]
 
 
 
 # which argument is cheapest to switch to 'Theme' [we need at least one!]?
 # return old v if one argument was 'Theme' already: no change.
 def enforce_one_Theme(v, scores, Theme_argument):
-    Theme_responses = [s[Theme_argument] for s in scores]
-    if not u'Theme' in Theme_responses:
+    if not Theme_argument in v:
         Delta = []
         for j in range(len(v)):
             #check score difference between 'Theme' and unconstr. prediction
             Delta_j = scores[j][v[j]] - scores[j][Theme_argument] 
             Delta += [Delta_j]
-        try:
+        if Delta:
             convert = Delta.index(min(Delta))
             v[convert] = Theme_argument
-        except Exception, _:
-            pass
     return v    
 
 
 # returns score of one particular combination of event and argument labels,
 # fully factorised case.
-def total_score_joint(X_trigger, Lambda_trigger, X_arguments, Lambda_argument,
-                event, arguments):
-    
-    ev_scores = perceptron.predict(X_trigger, Lambda_trigger,return_scores = True)
-    s_e = ev_scores[event]
+def total_score_joint(trigger_scores, argument_scores, event, arguments):
+    s_e = trigger_scores[event]
     
     #sum scores over all arguments
     s_a = 0.0
     for j in range(len(arguments)):
-        argument_scores = perceptron.predict(X_arguments[j], Lambda_argument, 
-                                             return_scores = True)
-        s_a += argument_scores[arguments[j]]
+        s_a += argument_scores[j][arguments[j]]
 
     return s_e + s_a
 
@@ -134,58 +147,40 @@ def total_score_joint(X_trigger, Lambda_trigger, X_arguments, Lambda_argument,
 # This function executes the argmax search in the constrained joint perceptron
 # as described in Exercise 3.
 def argmax_joint_constrained(X_trig, Lambda_trig, X_arg, Lambda_arg, FV):
-    
-    None_trigger = FV.trigger_list.index(u'None')
-    None_argument = FV.arguments_list.index(u'None')
-    Cause_argument = FV.arguments_list.index(u'Cause')
-    Theme_argument = FV.arguments_list.index(u'Theme')
+    trigger_scores, argument_scores = event_scores(X_trig, Lambda_trig, X_arg, Lambda_arg)
+    return decode_constrained(trigger_scores, argument_scores, constraint_classes(FV))
+
+
+# the constrained argmax of Exercise 3 from the score cache of one event
+# (see event_scores), with classes from constraint_classes.
+def decode_constrained(trigger_scores, argument_scores, classes):
+    N_arguments = len(argument_scores)
+    Theme_argument = classes['Theme_argument']
     
     #COMPUTE s1: case trigger==None and all arguments are None
-    e_1 = None_trigger
-    a_1 = [None_argument]*len(X_arg)
-    s1 = total_score_joint(X_trig, Lambda_trig, X_arg, Lambda_arg, e_1, a_1)
+    e_1 = classes['None_trigger']
+    a_1 = [classes['None_argument']]*N_arguments
+    s1 = total_score_joint(trigger_scores, argument_scores, e_1, a_1)
                      
 
     #COMPUTE s2: ONLY Regulation triggers are allowed
-    #identify the trigger indices for regulation events
-    Regulation_triggers = [i for i in range(len(FV.trigger_list)) \
-                               if 'egulation' in FV.trigger_list[i]]
-    legal_triggers = Regulation_triggers
-    e_2 = predict_under_constraint(X_trig, Lambda_trig, legal_triggers)
-    a_2 = []
-    scores = []
-    for j in range(len(X_arg)):
-        #generate unconstrained predictions, might so far miss a Theme argument 
-        a_j, sco = predict_under_constraint(X_arg[j], Lambda_arg, range(3), 
-                                                return_scores = True) 
-        a_2  += [ a_j ]
-        scores  += [ sco ]
+    e_2 = predict_under_constraint(trigger_scores, classes['Regulation_triggers'])
+    #generate unconstrained predictions, might so far miss a Theme argument 
+    a_2 = [int(np.argmax(argument_scores[j])) for j in range(N_arguments)]
         
     #check if Theme appears at least once. If not: adjust to second best score
-    a_2 = enforce_one_Theme(a_2, scores, Theme_argument)   
-    s2 = total_score_joint(X_trig, Lambda_trig, X_arg, Lambda_arg, e_2, a_2 )
+    a_2 = enforce_one_Theme(a_2, argument_scores, Theme_argument)   
+    s2 = total_score_joint(trigger_scores, argument_scores, e_2, a_2)
 
     
     #COMPUTE s3: no regulation triggers or None trigger allowed.
     #Restrict possible argument labels to 'None' and 'Theme' [--> skip 'Cause']
-    legal_triggers = range(10)
-    for r in Regulation_triggers:
-        legal_triggers.remove(r)
-    legal_triggers.remove(None_trigger)
-    e_3 = predict_under_constraint(X_trig, Lambda_trig, legal_triggers)
-    
-    legal_arglabels = range(3)
-    legal_arglabels.remove(Cause_argument)
-    
-    a_3 = []
-    scores = []
-    for j in range(len(X_arg)):
-        a_j, sco = predict_under_constraint(X_arg[j], Lambda_arg, legal_arglabels, 
-                                            return_scores = True) 
-        a_3  += [ a_j ]
-        scores  += [ sco ]
-    a_3 = enforce_one_Theme(a_3, scores, Theme_argument)    
-    s3 = total_score_joint(X_trig, Lambda_trig, X_arg, Lambda_arg, e_3, a_3 )
+    e_3 = predict_under_constraint(trigger_scores, classes['Other_triggers'])
+    legal_arglabels = [classes['None_argument'], Theme_argument]
+    a_3 = [predict_under_constraint(argument_scores[j], legal_arglabels) 
+           for j in range(N_arguments)]
+    a_3 = enforce_one_Theme(a_3, argument_scores, Theme_argument)    
+    s3 = total_score_joint(trigger_scores, argument_scores, e_3, a_3)
     
     
     #Compare s1,s2,s3. Identify final highest scoring case; return its parameters
@@ -199,10 +194,11 @@ def argmax_joint_constrained(X_trig, Lambda_trig, X_arg, Lambda_arg, FV):
     
     
 # prediction function to be called when training the joint perceptron.
-def predict_joint(X_trigger, Lambda_trigger, X_arguments, Lambda_argument, mode):
+def predict_joint(X_trigger, Lambda_trigger, X_arguments, Lambda_argument, mode, FV = None):
     """
     e: event trigger [10 possible event triggers]
     a: vector of argument labels. Each element is from [None, Theme, Cause]
+    FV: the FeatureVector, needed in constrained mode
     """
     if mode == 'Joint_unconstrained':
         #predictions can be computed individually, since joint prob factorises 
@@ -222,60 +218,114 @@ def predict_joint(X_trigger, Lambda_trigger, X_arguments, Lambda_argument, mode)
                         + '"constrained" or "unconstrained". ###')
         
           
-# assembling the feature matrices for all events in one file.
+# assembling the feature matrices for all events in one file (a json file name
+# or a columnar_corpus.ColumnarDocument).
 def build_joint_data_batch(file_name, FV, subsample = True):
     gold_list = []
     feature_matrix_list = []   #list of feature matrices for both trigger & argument
-    f_json = json.load(open(file_name)) 
     
-    for sentence in f_json['sentences']:
-        event_candidates_list = sentence['eventCandidates']
-        
-        for event in event_candidates_list:
-            argumentslist = event['arguments']
-            gold_trigger = event['gold']
-            token_index = event['begin']
+    for sentence, events in columnar_corpus.iter_sentences(file_name):
+        for token_index, gold_trigger, arguments in events:
             trigger_matrix = FV.get_feature_matrix(token_index, sentence) 
             
             gold_arguments = []
             argument_matrices = []
-            for argument in argumentslist:
-                arg_index = argument['begin']
-                gold_arguments.append( argument['gold'] )
+            for arg_index, gold in arguments:
+                gold_arguments.append( gold )
                 argument_matrices.append( FV.get_feature_matrix_argument_prediction(token_index, 
                                                        arg_index, sentence) )
     
             gold_list += [(gold_trigger, gold_arguments)]
             feature_matrix_list += [(trigger_matrix, argument_matrices)]
     if subsample:
-        trig_list = [item[0] for item in gold_list]
-        arg_list = [item[1] for item in gold_list]
-        arg_list = [item for sublist in arg_list for item in sublist]
-        print "before subsampling Trigger:", trig_list.count(u'None'), 'of',len(gold_list)
-        print "before subsampling Arg:", arg_list.count(u'None'), 'of', len(arg_list) 
-        
-        (feature_matrix_list, gold_list) = subsample_jointly(feature_matrix_list, 
-                                            gold_list, rate_trig=.95, rate_arg=.95)
-                                            
-        trig_list = [item[0] for item in gold_list]
-        arg_list = [item[1] for item in gold_list]
-        arg_list = [item for sublist in arg_list for item in sublist]
-        print "after subsampling Trigger:", trig_list.count(u'None'), 'of',len(gold_list)
-        print "after subsampling Arg:", arg_list.count(u'None'), 'of', len(arg_list) 
+        (feature_matrix_list, gold_list) = subsample_joint_batch(feature_matrix_list, gold_list)
 
     return (feature_matrix_list, gold_list)
 
 
-# create joint perceptron predictions on a test set
-def test_perceptron_joint(FV, Lambda_trig, Lambda_arg, file_list, mode, subsample = False):
-    #Test data from all files in file_list
+# subsample the events and arguments of one file, as done in build_joint_data_batch
+def subsample_joint_batch(feature_matrix_list, gold_list):
+    trig_list = [item[0] for item in gold_list]
+    arg_list = [item[1] for item in gold_list]
+    arg_list = [item for sublist in arg_list for item in sublist]
+    print "before subsampling Trigger:", trig_list.count(u'None'), 'of',len(gold_list)
+    print "before subsampling Arg:", arg_list.count(u'None'), 'of', len(arg_list) 
+    
+    (feature_matrix_list, gold_list) = subsample_jointly(feature_matrix_list, 
+                                        gold_list, rate_trig=.95, rate_arg=.95)
+                                        
+    trig_list = [item[0] for item in gold_list]
+    arg_list = [item[1] for item in gold_list]
+    arg_list = [item for sublist in arg_list for item in sublist]
+    print "after subsampling Trigger:", trig_list.count(u'None'), 'of',len(gold_list)
+    print "after subsampling Arg:", arg_list.count(u'None'), 'of', len(arg_list) 
+    return (feature_matrix_list, gold_list)
+
+
+# joint features and gold labels of all events in file_list, in file order. The
+# files are featurized on n_jobs worker processes (None: all cores); subsampling
+# happens per file in this process, so it doesn't depend on n_jobs.
+def build_joint_data(FV, file_list, subsample, n_jobs = 1):
+    print 'Building data from', len(file_list), 'json files'
+    batches = parallel_extraction.map_documents(build_joint_data_batch, file_list, FV,
+                                                args = (False,), n_jobs = n_jobs)
     feature_list = []
     gold_list = []
-    for i_f, file_name in enumerate(file_list):
-        print 'Building test data from json file ',i_f , 'of', len(file_list)
-        (feat_list_one_file, gold_list_one_file) = build_joint_data_batch(file_name, FV, subsample)
+    for (feat_list_one_file, gold_list_one_file) in batches:
+        if subsample:
+            (feat_list_one_file, gold_list_one_file) = subsample_joint_batch(
+                                                feat_list_one_file, gold_list_one_file)
         feature_list += feat_list_one_file
         gold_list += gold_list_one_file
+    return feature_list, gold_list
+
+
+# event samples (e, argument row numbers) and gold tuples of a joint dataset
+# (trigger Dataset, argument Dataset), see dataset.load_joint_dataset.
+# Subsampling is done over the whole dataset rather than per file.
+def joint_dataset_samples(FV, data, subsample):
+    trigger_data, argument_data = data
+    feature_list = []
+    gold_list = []
+    for e in range(len(trigger_data)):
+        argument_rows = argument_data.group(e)
+        feature_list += [(e, argument_rows)]
+        gold_list += [(FV.trigger_list[trigger_data.labels[e]],
+                       [FV.arguments_list[argument_data.labels[j]] for j in argument_rows])]
+    if subsample:
+        (feature_list, gold_list) = subsample_joint_batch(feature_list, gold_list)
+    return feature_list, gold_list
+
+
+# trigger and argument feature rows of an event sample of a joint dataset
+def joint_sample_rows(data, sample):
+    e, argument_rows = sample
+    return data[0].row(e), [data[1].row(j) for j in argument_rows]
+
+
+# create joint perceptron predictions on a test set
+# data: (trigger Dataset, argument Dataset) to predict instead of file_list
+def test_perceptron_joint(FV, Lambda_trig, Lambda_arg, file_list, mode, subsample = False,
+                          n_jobs = 1, data = None):
+    if not subsample:
+        #decode all events at once
+        import joint_decoding
+        if data is None:
+            data = dataset.load_joint_dataset(FV, file_list, n_jobs)
+        predictions_e, predictions_a = joint_decoding.predict_joint_batch(FV, data, 
+                                                    Lambda_trig, Lambda_arg, mode)
+        trigger_data, argument_data = data
+        gold_e = trigger_data.labels.tolist()
+        gold_a = [argument_data.labels[argument_data.group(e)].tolist() 
+                  for e in range(len(trigger_data))]
+        print len(predictions_e)
+        return predictions_e, gold_e, predictions_a, gold_a
+
+    #Test data from all files in file_list
+    if data is None:
+        feature_list, gold_list = build_joint_data(FV, file_list, subsample, n_jobs)
+    else:
+        feature_list, gold_list = joint_dataset_samples(FV, data, subsample)
 
     predictions_e = []    
     predictions_a = []
@@ -284,8 +334,10 @@ def test_perceptron_joint(FV, Lambda_trig, Lambda_arg, file_list, mode, subsampl
     N_samples = len(feature_list)
 
     for sample in range(N_samples):
-        X_trigger = feature_list[sample][0]
-        X_arguments = feature_list[sample][1]
+        if data is None:
+            X_trigger, X_arguments = feature_list[sample]
+        else:
+            X_trigger, X_arguments = joint_sample_rows(data, feature_list[sample])
         
         gold_trigger = gold_list[sample][0]
         gold_arguments = gold_list[sample][1]
@@ -294,7 +346,7 @@ def test_perceptron_joint(FV, Lambda_trig, Lambda_arg, file_list, mode, subsampl
         gold_a += [ [ FV.arguments_list.index(ga) for ga in gold_arguments] ]
         
         y_hat_e, y_hat_a = predict_joint(X_trigger, Lambda_trig, \
-                                         X_arguments, Lambda_arg, mode)    
+                                         X_arguments, Lambda_arg, mode, FV)    
         predictions_e += [y_hat_e]    
         predictions_a += [y_hat_a]
     
@@ -304,28 +356,38 @@ def test_perceptron_joint(FV, Lambda_trig, Lambda_arg, file_list, mode, subsampl
 
 # Training routine for joint perceptron model
 def train_perceptron_joint(FV, training_files, T_max = 1, LR = 1.0, 
-                           mode = 'Joint_unconstrained', plot = True):
+                           mode = 'Joint_unconstrained', plot = True, n_jobs = 1,
+                           data = None, parallel = None, n_workers = None):
+    """
+    data: (trigger Dataset, argument Dataset) to train on instead of the
+    event candidates of training_files, see dataset.load_joint_dataset
+    parallel: 'mixing' to train on n_workers processes (None: all cores) with
+    iterative parameter mixing, see parallel_training.py
+    """
     if mode == 'Joint_unconstrained' or mode == 'Joint_constrained':
         pass
     else: 
         warnings.warn('Error in train_perceptron_joint: Must have mode ' \
         + '"Joint_unconstrained" or"Joint_constrained" ' ) 
+    if parallel is not None:
+        import parallel_training
+        return parallel_training.train_perceptron_joint_parallel(FV, training_files, T_max, 
+                                        LR, mode, plot, n_jobs, data, parallel, n_workers)
 
     t_start = time.time()
     N_files = len(training_files)
     
     #Generate training data
-    feature_list = []
-    gold_list = []
-    for i_f, filename in enumerate(training_files):
-        print 'Building training data from json file ',i_f
-        (feat_list_one_file, gold_list_one_file) = build_joint_data_batch(filename, FV, subsample=True)
-        
-        feature_list += feat_list_one_file
-        gold_list += gold_list_one_file
+    if data is None:
+        feature_list, gold_list = build_joint_data(FV, training_files, subsample = True, 
+                                                   n_jobs = n_jobs)
+    else:
+        feature_list, gold_list = joint_dataset_samples(FV, data, subsample = True)
     
-    N_classes_trigger, N_dims_trigger = feature_list[0][0].shape
-    N_classes_argument, N_dims_argument = feature_list[0][1][0].shape
+    N_classes_trigger = len(FV.trigger_list)
+    N_dims_trigger = FV.dim_trigger
+    N_classes_argument = len(FV.arguments_list)
+    N_dims_argument = FV.dim_argument
     N_samples = len(feature_list)
 
     #initialise parameters
@@ -339,46 +401,9 @@ def train_perceptron_joint(FV, training_files, T_max = 1, LR = 1.0,
     #start training epochs
     while iteration < T_max:
         iteration+=1
-        misclassified_t = 0
-        misclassified_a = 0
-
-        for sample in range(N_samples):
-            X_trigger = feature_list[sample][0]
-            X_arguments = feature_list[sample][1]
-            
-            gold_trigger = gold_list[sample][0]
-            gold_arguments = gold_list[sample][1]
-            
-            y_trigger = FV.trigger_list.index(gold_trigger)
-            y_arguments = [ FV.arguments_list.index(ga) for ga in gold_arguments]
-            
-            y_hat_e, y_hat_a = predict_joint(X_trigger, Lambda_trigger, \
-                                             X_arguments, Lambda_argument, mode)
-                                             
-            if not sample % 50:
-                print 'it',iteration, sample, 'of', N_samples,'Predict:', y_hat_e, 'True:', y_trigger
-                
-            if y_hat_e != y_trigger:
-                misclassified_t +=1
-                #adjust trigger weights
-                Delta_trigger = np.zeros([N_classes_trigger, N_dims_trigger])
-                Delta_trigger[y_hat_e, :] = -LR * X_trigger.getrow(y_hat_e).todense() 
-                Delta_trigger[y_trigger , :] = LR * X_trigger.getrow(y_trigger).todense() 
-
-                Lambda_New = np.add(Lambda_trigger, Delta_trigger)
-                Lambda_trigger = Lambda_New
-            if y_hat_a != y_arguments:
-                misclassified_a +=1
-                #adjust argument weights
-                for j in range(len(y_arguments)):
-                    Delta_arg = np.zeros([N_classes_argument, N_dims_argument])
-                    Delta_arg[y_hat_a[j] , :] = -LR * X_arguments[j].getrow(y_hat_a[j]).todense() 
-                    Delta_arg[y_arguments[j] , :] = LR * X_arguments[j].getrow(y_arguments[j]).todense() 
-    
-                    Lambda_New = np.add(Lambda_argument, Delta_arg)
-                    Lambda_argument = Lambda_New
-            else:
-                pass #prediction correct, no change.predict_joint
+        misclassified_t, misclassified_a = train_joint_epoch(FV, Lambda_trigger, 
+                                    Lambda_argument, feature_list, gold_list, 
+                                    range(N_samples), LR, mode, data, iteration)
                 
         misclassification_rates_t += [ float(misclassified_t)/float(N_samples) ]
         misclassification_rates_a += [ float(misclassified_a)/float(N_samples) ]
@@ -389,6 +414,55 @@ def train_perceptron_joint(FV, training_files, T_max = 1, LR = 1.0,
         plt.plot(misclassification_rates_a, 'g', label='argument')
         plt.legend()
     return Lambda_trigger, Lambda_argument, misclassification_rates_t, misclassification_rates_a
+
+
+# one joint perceptron epoch over the event samples with the given numbers, in
+# that order (data: the joint dataset the samples refer to, if any). Lambdas are
+# updated in place; returns the numbers of misclassified triggers and argument
+# sequences.
+def train_joint_epoch(FV, Lambda_trigger, Lambda_argument, feature_list, gold_list, 
+                      samples, LR, mode, data = None, iteration = 0):
+    N_samples = len(samples)
+    misclassified_t = 0
+    misclassified_a = 0
+
+    for i_s, sample in enumerate(samples):
+        if data is None:
+            X_trigger, X_arguments = feature_list[sample]
+        else:
+            X_trigger, X_arguments = joint_sample_rows(data, feature_list[sample])
+        
+        gold_trigger = gold_list[sample][0]
+        gold_arguments = gold_list[sample][1]
+        
+        y_trigger = FV.trigger_list.index(gold_trigger)
+        y_arguments = [ FV.arguments_list.index(ga) for ga in gold_arguments]
+        
+        y_hat_e, y_hat_a = predict_joint(X_trigger, Lambda_trigger, \
+                                         X_arguments, Lambda_argument, mode, FV)
+                                         
+        if not i_s % 50:
+            print 'it',iteration, i_s, 'of', N_samples,'Predict:', y_hat_e, 'True:', y_trigger
+            
+        if y_hat_e != y_trigger:
+            misclassified_t +=1
+            #adjust trigger weights
+            perceptron.update_weights(Lambda_trigger, X_trigger, y_trigger, y_hat_e, LR)
+        if y_hat_a != y_arguments:
+            misclassified_a +=1
+            #adjust argument weights
+            for j in range(len(y_arguments)):
+                if y_hat_a[j] != y_arguments[j]:
+                    perceptron.update_weights(Lambda_argument, X_arguments[j], 
+                                              y_arguments[j], y_hat_a[j], LR)
+                else:
+                    #correctly labelled arguments of a wrong sequence are
+                    #still pushed towards their gold class
+                    X = X_arguments[j].tocsr()
+                    Lambda_argument[y_arguments[j], X.indices] += LR * X.data
+        else:
+            pass #prediction correct, no change.
+    return misclassified_t, misclassified_a
  
  
  
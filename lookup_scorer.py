@@ -0,0 +1,161 @@
+"""
+Lookup-table scorer for trained perceptron weights. Every feature template is
+one-hot (or a small set of one-hot ids) over its own vocabulary: a pos tag, a
+stem, a set of dep labels or characters. The columns of Lambda that belong to a
+template can therefore be stored as a table with one row of class scores per
+template id, e.g. pos id -> class scores. A candidate is scored by adding up
+the table rows of the ids its templates return, without building a feature
+vector or multiplying with Lambda.
+"""
+
+import cPickle
+from collections import defaultdict
+import numpy as np
+
+
+# per-template tables of the weights Lambda (n_classes x dim) of a trigger or
+# argument ('trigger'/'argument') perceptron with the feature layout of FV.
+# Returns a dict template name -> (template dim x n_classes) array.
+def compile_tables(Lambda, FV, mode):
+    templates = FV.templates_trig if mode == 'trigger' else FV.templates_arg
+    tables = {}
+    for phi, offset in templates:
+        name = phi.__name__
+        dim = FV.feature_space.template_dim(name)
+        tables[name] = np.ascontiguousarray(Lambda[:, offset:offset+dim].T)
+    return tables
+
+
+"""
+Scores candidates from the compiled tables of a trigger or argument perceptron.
+"""
+class LookupScorer(object):
+    def __init__(self, tables, FV, mode):
+        self.tables = tables
+        self.FV = FV
+        self.mode = mode
+        self.n_classes = tables.values()[0].shape[1]
+        #(template function, table) in the order of the feature row
+        templates = FV.templates_trig if mode == 'trigger' else FV.templates_arg
+        self.templates = [(phi, tables[phi.__name__]) for phi, _ in templates]
+
+    @classmethod
+    def from_weights(cls, Lambda, FV, mode):
+        return cls(compile_tables(Lambda, FV, mode), FV, mode)
+
+    def save(self, file_name):
+        savedata = {'key': self.FV.feature_space.key,
+                    'mode': self.mode,
+                    'tables': self.tables}
+        with open(file_name, 'wb') as f:
+            cPickle.dump(savedata, f, cPickle.HIGHEST_PROTOCOL)
+
+    #returns None if the tables were compiled for another feature space than FV's
+    @classmethod
+    def load(cls, file_name, FV):
+        with open(file_name, 'rb') as f:
+            loaded = cPickle.load(f)
+        if loaded['key'] != FV.feature_space.key:
+            return None
+        return cls(loaded['tables'], FV, loaded['mode'])
+
+    #linear score of every class for the trigger candidate token_index, or for
+    #the argument candidate arg_index of trigger token_index (argument mode).
+    def scores(self, token_index, sentence, arg_index = None):
+        sentence = self.FV.get_sentence_index(sentence)
+        if self.mode == 'trigger':
+            args = (token_index, sentence)
+        else:
+            args = (token_index, arg_index, sentence)
+        scores = np.zeros(self.n_classes)
+        for phi, table in self.templates:
+            for i in phi(*args):
+                scores += table[i]
+        return scores
+
+    #highest scoring class id
+    def predict(self, token_index, sentence, arg_index = None):
+        return int(self.scores(token_index, sentence, arg_index).argmax())
+
+
+# argument templates that depend only on the trigger token, and those that
+# depend on the pair (only through a dependency between the two tokens). All
+# other argument templates depend only on the argument token.
+TRIGGER_TEMPLATES = ['phi_argument_2', 'phi_argument_3']
+PAIR_TEMPLATES = ['phi_argument_8']
+
+
+"""
+Argument scorer that factorizes the argument score of a (trigger, argument)
+pair into a trigger part, computed once per event candidate, an argument part,
+computed once per token, and the pair part of dependency-connected pairs.
+"""
+class FactorizedArgumentScorer(LookupScorer):
+    def __init__(self, tables, FV, mode = 'argument'):
+        LookupScorer.__init__(self, tables, FV, 'argument')
+        self.trigger_templates = [(phi, table) for phi, table in self.templates
+                                  if phi.__name__ in TRIGGER_TEMPLATES]
+        self.pair_templates = [(phi, table) for phi, table in self.templates
+                               if phi.__name__ in PAIR_TEMPLATES]
+        self.argument_templates = [(phi, table) for phi, table in self.templates
+                                   if phi.__name__ not in TRIGGER_TEMPLATES + PAIR_TEMPLATES]
+
+    def _sum_rows(self, templates, token_index, arg_index, sentence):
+        scores = np.zeros(self.n_classes)
+        for phi, table in templates:
+            for i in phi(token_index, arg_index, sentence):
+                scores += table[i]
+        return scores
+
+    #trigger part of the scores, one row per trigger token
+    def trigger_scores(self, trigger_indices, sentence):
+        sentence = self.FV.get_sentence_index(sentence)
+        return np.array([self._sum_rows(self.trigger_templates, t, None, sentence)
+                         for t in trigger_indices]).reshape(-1, self.n_classes)
+
+    #argument part of the scores, one row per argument token
+    def argument_scores(self, arg_indices, sentence):
+        sentence = self.FV.get_sentence_index(sentence)
+        return np.array([self._sum_rows(self.argument_templates, None, a, sentence)
+                         for a in arg_indices]).reshape(-1, self.n_classes)
+
+    #pair part of the scores, (n_triggers x n_arguments x n_classes). Only pairs
+    #where the argument is the head of a dependency with the trigger as mod are
+    #evaluated (see phi_argument_8), all others are 0.
+    def pair_scores(self, trigger_indices, arg_indices, sentence):
+        sentence = self.FV.get_sentence_index(sentence)
+        P = np.zeros((len(trigger_indices), len(arg_indices), self.n_classes))
+        trigger_positions = defaultdict(list)
+        for i, t in enumerate(trigger_indices):
+            trigger_positions[t].append(i)
+        arg_positions = defaultdict(list)
+        for j, a in enumerate(arg_indices):
+            arg_positions[a].append(j)
+        for a, t in list(sentence.pair_labels.keys()):
+            for i in trigger_positions.get(t, []):
+                for j in arg_positions.get(a, []):
+                    P[i, j] = self._sum_rows(self.pair_templates, t, a, sentence)
+        return P
+
+    #scores of all (trigger, argument) pairs of a sentence as the sum of the
+    #precomputed parts: (n_triggers x n_arguments x n_classes)
+    def sentence_scores(self, trigger_indices, arg_indices, sentence):
+        sentence = self.FV.get_sentence_index(sentence)
+        return (self.trigger_scores(trigger_indices, sentence)[:, None, :]
+                + self.argument_scores(arg_indices, sentence)[None, :, :]
+                + self.pair_scores(trigger_indices, arg_indices, sentence))
+
+    #scores of the arguments arg_indices of one event candidate (trigger
+    #token_index): (n_arguments x n_classes)
+    def event_scores(self, token_index, arg_indices, sentence):
+        return self.sentence_scores([token_index], arg_indices, sentence)[0]
+
+
+if 0:
+    #compile the pretrained trigger perceptron for fast inference
+    import feature_vector
+    FV_trig = feature_vector.FeatureVector('trigger')
+    with open('Perceptron_trigger.data', 'rb') as f:
+        Lambda_e, misc_e = cPickle.load(f)
+    scorer = LookupScorer.from_weights(Lambda_e, FV_trig, 'trigger')
+    scorer.save('Perceptron_trigger_tables.data')
@@ -1,8 +1,17 @@
 import numpy as np
 from scipy.sparse import issparse
-from sklearn.preprocessing import LabelBinarizer
 from scipy.sparse import coo_matrix
 from pprint import pprint
+from dataset import Dataset
+
+
+# data matrix as used by NaiveBayes: sparse input (or a dataset.Dataset) as csr
+def as_array(X):
+	if isinstance(X, Dataset):
+		return X.to_csr()
+	if issparse(X):
+		return X.tocsr()
+	return X
 
 
 class NaiveBayes(object):
@@ -11,56 +20,120 @@ class NaiveBayes(object):
 		# self.classes = []
 		# self.feature_log_prob = []
 		self.class_prior = []
+		self.classes = None
+		self.class_count = None
+		self.feature_count = None
 
 	def train(self, X, y):
-		n_features = X.shape[1]
-
-		# class_prior = self.class_prior
+		X = as_array(X)
 
-		# Binarize Y
-		labelbin = LabelBinarizer()
-		Y = labelbin.fit_transform(y)
-		self.classes = labelbin.classes_
-		if Y.shape[1] == 1:
-			Y = np.concatenate((1 - Y, Y), axis=1)
+		print "Start counting..."
+		self.classes = None
+		self.class_count = None
+		self.partial_fit(X, y, classes=np.unique(y))
+		print "Finished counting!"
+
+		return self.finalize()
+
+	def partial_fit(self, X, y, classes=None):
+		"""
+		Add the class and class-feature counts of one batch (X, y) to the model.
+		classes (all labels that can occur) is needed on the first call. Call
+		finalize() once all batches are counted.
+		"""
+		X = as_array(X)
+		y = np.asarray(y)
+		if self.class_count is None:
+			if classes is None:
+				raise ValueError('classes must be given on the first call to partial_fit')
+			self.classes = np.unique(classes)
+			self.class_count = np.zeros(len(self.classes))
+			self.feature_count = np.zeros((len(self.classes), X.shape[1]))
+		# Nothing to count (e.g. a document without candidates)
+		if len(y) == 0:
+			return self
+
+		# Binarize y
+		Y = (y.reshape(-1, 1) == self.classes.reshape(1, -1)).astype(np.float64)
+		if Y.sum() < len(y):
+			raise ValueError('partial_fit got labels that are not in classes')
+
+		self.class_count += Y.sum(axis=0)
+		if issparse(X):
+			self.feature_count += np.asarray(X.T.dot(Y)).T
+		else:
+			self.feature_count += np.dot(Y.T, X)
+		return self
 
-		n_effective_classes = Y.shape[1]
-		self.class_count = np.zeros(n_effective_classes)
-		self.feature_count = np.zeros((n_effective_classes, n_features))
+	def merge(self, other):
+		"""
+		Add the counts of other (e.g. counted on another batch or in another
+		process) to the counts of this model.
+		"""
+		if other.class_count is None:
+			return self
+		if self.class_count is None:
+			self.classes = other.classes
+			self.class_count = other.class_count.copy()
+			self.feature_count = other.feature_count.copy()
+			return self
+		if not np.array_equal(self.classes, other.classes) \
+				or self.feature_count.shape != other.feature_count.shape:
+			raise ValueError('Can only merge NaiveBayes counts of the same classes and features')
+		self.class_count += other.class_count
+		self.feature_count += other.feature_count
+		return self
 
-		print "Start counting..."
-		self.class_count = Y.sum(axis=0)
-		print "Finished class counting!"
-		print "Start feature counting..."
-		self.feature_count = np.dot(Y.T, X)
-		print "Finished feature counting!"
+	def finalize(self):
+		"""
+		Smooth the counts and convert them to log probabilities. As in train,
+		only classes that occur in the counts are kept.
+		"""
+		seen = self.class_count > 0
+		self.classes = self.classes[seen]
+		self.class_count = self.class_count[seen]
+		self.feature_count = self.feature_count[seen]
 
 		# Apply add-k-smoothing
-		print "Start smoothing..."
 		self.class_count_smooth = self.class_count + self.k * len(self.classes)
 		self.feature_count_smooth = self.feature_count + self.k
-		print "Finished smooting!"
 
 		# Convert to log probabilities
 		self.feature_log_prob = (np.log(self.feature_count_smooth) - np.log(self.class_count_smooth.reshape(-1,1)))
 		self.class_log_prior = np.zeros(len(self.classes)) - np.log(len(self.classes))
 
-		return self
+		return self.compile()
 
-	def predict(self, X):
+	def compile(self):
+		"""
+		Freeze the scoring terms of the trained model: the joint log-likelihood
+		of X is X . feature_weights + bias.
+		"""
 		neg_prob = np.log(1 - np.exp(self.feature_log_prob))
-		# print self.feature_count.shape
-		# print self.feature_count_smooth.shape
-		# print self.feature_log_prob.shape
-		# print neg_prob.shape
-		jll = np.dot(X, (self.feature_log_prob - neg_prob).T)
-		# print jll.shape
-		# print type(self.class_log_prior)
-		# print self.class_log_prior.shape
-		# print type(neg_prob.sum(axis=1))
-		# print neg_prob.sum(axis=1).shape
-		jll += self.class_log_prior + neg_prob.sum(axis=1)
-		return self.classes[np.argmax(jll, axis=1)]
+		self.feature_weights = np.ascontiguousarray((self.feature_log_prob - neg_prob).T)
+		self.bias = self.class_log_prior + neg_prob.sum(axis=1)
+		return self
+
+	def joint_log_likelihood(self, X):
+		if issparse(X):
+			jll = np.asarray(X.dot(self.feature_weights))
+		else:
+			jll = np.dot(X, self.feature_weights)
+		jll += self.bias
+		return jll
+
+	def predict(self, X, chunk_size=4096):
+		"""
+		Predict the rows of X in blocks of chunk_size rows, so the extra memory
+		does not grow with the number of rows.
+		"""
+		X = as_array(X)
+		n_samples = X.shape[0]
+		y_pred = np.empty(n_samples, dtype=np.intp)
+		for start in xrange(0, n_samples, chunk_size):
+			end = min(start + chunk_size, n_samples)
+			y_pred[start:end] = np.argmax(self.joint_log_likelihood(X[start:end]), axis=1)
+		return self.classes[y_pred]
 
 	def evaluate(self, X, y):
 		# Construct confusion matrix
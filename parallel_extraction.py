@@ -0,0 +1,42 @@
+"""
+Process-pool feature extraction across documents. map_documents runs one of the
+build_*_data_batch functions (or any function(document, FV, *args)) for every
+document on a pool of worker processes and returns the results in file order.
+
+The task (function, documents, FeatureVector) is put into a module global before
+the pool is forked, so the workers inherit the FeatureVector and its
+vocabularies instead of loading or unpickling them, and only the position of
+each document is sent to them.
+"""
+
+import multiprocessing
+
+
+#(function, documents, FV, args) of the running map_documents call
+_task = None
+
+
+def _run(i):
+    function, documents, FV, args = _task
+    return function(documents[i], FV, *args)
+
+
+# [function(document, FV, *args) for document in documents], computed on n_jobs
+# worker processes (default: all cores). Results are in the order of documents.
+def map_documents(function, documents, FV, args = (), n_jobs = None):
+    global _task
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(documents))
+    if n_jobs <= 1:
+        return [function(document, FV, *args) for document in documents]
+
+    _task = (function, documents, FV, args)
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        chunksize = max(1, len(documents) // (4*n_jobs))
+        return pool.map(_run, range(len(documents)), chunksize)
+    finally:
+        pool.close()
+        pool.join()
+        _task = None
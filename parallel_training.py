@@ -0,0 +1,192 @@
+"""
+Multi-process perceptron training on one multi-core machine.
+
+Iterative parameter mixing ('mixing'): in every epoch the training samples are
+shuffled and split into one shard per worker process. Every worker runs one
+perceptron epoch over its shard, starting from the current weights, and the
+weights of all workers are averaged afterwards.
+
+Hogwild ('hogwild', train_perceptron only): the weights are one matrix in
+shared memory that all workers update in place, without any locks, while each
+streams its own slice of the (re-shuffled) training samples. The feature rows
+are very sparse, so two workers rarely touch the same weights at once.
+
+As in parallel_extraction, the training data (and the shared weights) is put
+into a module global before the pool is forked, so the workers inherit it and
+only the sample numbers of each shard (and for mixing the weights) are sent to
+them.
+"""
+
+import time
+import warnings
+import multiprocessing
+import numpy as np
+import perceptron_sketch as perceptron
+import joint_perceptron as jnt
+
+
+#training data of the running training call, inherited by the workers
+_task = None
+
+
+def _mixing_epoch(args):
+    Lambda, rows, iteration = args
+    data, LR = _task
+    misclassified = perceptron.train_epoch(Lambda, data, rows, LR, iteration)
+    return Lambda, misclassified
+
+
+def _hogwild_epoch(args):
+    rows, iteration = args
+    data, LR, Lambda = _task
+    return perceptron.train_epoch(Lambda, data, rows, LR, iteration)
+
+
+def _joint_mixing_epoch(args):
+    Lambda_trigger, Lambda_argument, samples, iteration = args
+    FV, feature_list, gold_list, data, LR, mode = _task
+    misclassified_t, misclassified_a = jnt.train_joint_epoch(FV, Lambda_trigger,
+                                    Lambda_argument, feature_list, gold_list, samples,
+                                    LR, mode, data, iteration)
+    return Lambda_trigger, Lambda_argument, misclassified_t, misclassified_a
+
+
+# float64 matrix of the given shape in memory that is shared with the worker
+# processes forked afterwards
+def shared_matrix(shape):
+    raw = multiprocessing.RawArray('d', int(np.prod(shape)))
+    return np.frombuffer(raw, dtype = np.float64).reshape(shape)
+
+
+# the samples in random order, split into n_shards shards of (almost) equal size
+def shuffled_shards(samples, n_shards):
+    perm = np.random.permutation(len(samples))
+    return [[samples[i] for i in part] for part in np.array_split(perm, n_shards)]
+
+
+# run function on every element of args_list, on a pool of n_workers processes
+# forked after setting task (in this process if n_workers is 1).
+class _Workers(object):
+    def __init__(self, task, n_workers):
+        global _task
+        _task = task
+        self.pool = multiprocessing.Pool(n_workers) if n_workers > 1 else None
+
+    def map(self, function, args_list):
+        if self.pool is None:
+            return map(function, args_list)
+        return self.pool.map(function, args_list)
+
+    def close(self):
+        global _task
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        _task = None
+
+
+def _n_workers(n_workers, N_samples):
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    return max(1, min(n_workers, N_samples))
+
+
+# train_perceptron on n_workers processes (None: all cores), see the module
+# docstring. Same arguments and return values as train_perceptron.
+def train_perceptron_parallel(FV, training_files, T_max = 1, LR = 1.0, mode = 'Trigger',
+                              subs_rate = 0.8, n_jobs = 1, store = None, data = None,
+                              parallel = 'mixing', n_workers = None):
+    if parallel not in ['mixing', 'hogwild']:
+        warnings.warn('Error in train_perceptron_parallel: parallel must be "mixing" ' \
+                      + 'or "hogwild"!')
+    t_start = time.time()
+    N_files = len(training_files)
+
+    #Generate training data
+    data, rows = perceptron.training_data(FV, training_files, mode, subs_rate, n_jobs,
+                                          store, data)
+    N_classes = len(FV.trigger_list if mode == 'Trigger' else FV.arguments_list)
+    N_samples = len(rows)
+    n_workers = _n_workers(n_workers, N_samples)
+
+    #initialise parameters
+    Lambda = np.random.normal(0.0, 1.0, [N_classes, data.n_cols])
+    misclassification_rates = []
+
+    if parallel == 'hogwild':
+        shared_Lambda = shared_matrix(Lambda.shape)
+        shared_Lambda[:] = Lambda
+        workers = _Workers((data, LR, shared_Lambda), n_workers)
+    else:
+        workers = _Workers((data, LR), n_workers)
+    try:
+        for iteration in range(1, T_max+1):
+            shards = shuffled_shards(rows, n_workers)
+            if parallel == 'hogwild':
+                #all workers update shared_Lambda in place
+                misclassified = sum(workers.map(_hogwild_epoch,
+                                                [(shard, iteration) for shard in shards]))
+            else:
+                results = workers.map(_mixing_epoch,
+                                      [(Lambda, shard, iteration) for shard in shards])
+                #mix: average of the weights of all shards
+                Lambda = np.mean([L for L, _ in results], axis = 0)
+                misclassified = sum(m for _, m in results)
+            misclassification_rates += [ float(misclassified)/float(N_samples) ]
+    finally:
+        workers.close()
+    if parallel == 'hogwild':
+        Lambda = np.array(shared_Lambda)
+
+    print time.time()-t_start, 'sec for', N_files, 'Files and', T_max, 'epochs on', \
+        n_workers, 'workers.'
+    return Lambda, misclassification_rates
+
+
+# train_perceptron_joint on n_workers processes (None: all cores), see the
+# module docstring. Same arguments and return values as train_perceptron_joint.
+def train_perceptron_joint_parallel(FV, training_files, T_max = 1, LR = 1.0,
+                                    mode = 'Joint_unconstrained', plot = True, n_jobs = 1,
+                                    data = None, parallel = 'mixing', n_workers = None):
+    if parallel != 'mixing':
+        warnings.warn('Error in train_perceptron_joint_parallel: parallel must be "mixing"!')
+    t_start = time.time()
+    N_files = len(training_files)
+
+    #Generate training data
+    if data is None:
+        feature_list, gold_list = jnt.build_joint_data(FV, training_files, subsample = True,
+                                                       n_jobs = n_jobs)
+    else:
+        feature_list, gold_list = jnt.joint_dataset_samples(FV, data, subsample = True)
+    N_samples = len(feature_list)
+    n_workers = _n_workers(n_workers, N_samples)
+
+    #initialise parameters
+    Lambda_trigger = np.random.normal(0.0, 1.0, [len(FV.trigger_list), FV.dim_trigger])
+    Lambda_argument = np.random.normal(0.0, 1.0, [len(FV.arguments_list), FV.dim_argument])
+    misclassification_rates_t = []
+    misclassification_rates_a = []
+
+    workers = _Workers((FV, feature_list, gold_list, data, LR, mode), n_workers)
+    try:
+        for iteration in range(1, T_max+1):
+            shards = shuffled_shards(range(N_samples), n_workers)
+            results = workers.map(_joint_mixing_epoch,
+                                  [(Lambda_trigger, Lambda_argument, shard, iteration)
+                                   for shard in shards])
+            #mix: average of the weights of all shards
+            Lambda_trigger = np.mean([r[0] for r in results], axis = 0)
+            Lambda_argument = np.mean([r[1] for r in results], axis = 0)
+            misclassification_rates_t += [ float(sum(r[2] for r in results))/float(N_samples) ]
+            misclassification_rates_a += [ float(sum(r[3] for r in results))/float(N_samples) ]
+    finally:
+        workers.close()
+
+    print time.time()-t_start, 'sec for', N_files, 'Files and', T_max, 'epochs on', \
+        n_workers, 'workers.'
+    if plot:
+        jnt.plt.plot(misclassification_rates_t, 'b', label='trigger')
+        jnt.plt.plot(misclassification_rates_a, 'g', label='argument')
+        jnt.plt.legend()
+    return Lambda_trigger, Lambda_argument, misclassification_rates_t, misclassification_rates_a
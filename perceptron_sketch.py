@@ -12,7 +12,11 @@ and a function for subsampling None events.
 
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.sparse import vstack
 import feature_vector 
+import columnar_corpus
+import dataset
+import parallel_extraction
 import utils
 import json
 import time
@@ -49,22 +53,14 @@ def subsample(feature_list, trigger_list, subsampling_rate = 0.9):
 
 # generate one training batch in perceptron algorithm for event triggers. 
 # output: For all events in file file_name: the features (matrix) & triggers
+# file_name can also be a columnar_corpus.ColumnarDocument.
 def build_trigger_data_batch(file_name, FV, clf):
     trigger_list = []
-    token_index_list = []
-    sentence_list = []
-    f_json = utils.load_json_file(file_name)
-
-    for sentence in f_json['sentences']:
-        event_candidates_list = sentence['eventCandidates']
-        for event in event_candidates_list:
-            token_index_list.append( event['begin'] )
-            sentence_list.append(sentence)
-            trigger_list += [ event['gold'] ]
-
     matrix_list = []
-    for token_index,sentence in zip(token_index_list, sentence_list):
-        matrix_list.append( FV.get_feature_matrix(token_index, sentence, clf) )
+    for sentence, events in columnar_corpus.iter_sentences(file_name):
+        for token_index, gold, _ in events:
+            matrix_list.append( FV.get_feature_matrix(token_index, sentence, clf) )
+            trigger_list += [ gold ]
 
     if len(matrix_list) == 0:
         return None, None
@@ -81,17 +77,11 @@ def build_trigger_data_batch(file_name, FV, clf):
 def build_argument_data_batch(file_name, FV, clf):
     gold_list = []
     matrix_list = []
-    f_json = utils.load_json_file(file_name)
-
-    for sentence in f_json['sentences']:
-        event_candidates_list = sentence['eventCandidates']
-        for event in event_candidates_list:
-            argumentslist = event['arguments']
-            for argument in argumentslist:
-                arg_index = argument['begin']
-                token_index = event['begin'] 
+    for sentence, events in columnar_corpus.iter_sentences(file_name):
+        for token_index, _, arguments in events:
+            for arg_index, gold in arguments:
                 matrix_list.append( FV.get_feature_matrix_argument_prediction(token_index, arg_index, sentence, clf) )
-                gold_list.append( argument['gold'] )
+                gold_list.append( gold )
 
     if len(matrix_list) == 0:
         return None, None
@@ -102,21 +92,36 @@ def build_argument_data_batch(file_name, FV, clf):
         return vstack(matrix_list), gold_list
    
     
-# create predictions for test set. Test data is all data from files in file_list
-def test_perceptron(FV, Lambda, file_list, mode, subsample = False):
+# features and gold labels of all candidates in file_list, in file order.
+# The files are featurized on n_jobs worker processes (None: all cores).
+def build_data(FV, file_list, mode, n_jobs = 1):
+    if mode == 'Trigger':
+        build_batch = build_trigger_data_batch
+    elif mode == 'Argument':
+        build_batch = build_argument_data_batch
+    else:
+        warnings.warn('Error in build_data: Must have mode "Trigger" or "Argument"!' )
+
+    print 'Building data from', len(file_list), 'json files'
+    batches = parallel_extraction.map_documents(build_batch, file_list, FV, 
+                                                args = ('perc',), n_jobs = n_jobs)
     feature_list = []
     gold_list = []
-    for i_f, filename in enumerate(file_list):
-        print 'Building test data from json file ',i_f , 'of', len(file_list)
-        if mode == 'Trigger':
-            (feat_list_one_file, gold_list_one_file) = build_trigger_data_batch(filename, FV, clf='perc')
-        elif mode == 'Argument':
-            (feat_list_one_file, gold_list_one_file) = build_argument_data_batch(filename, FV, clf='perc')
-        else:
-            warnings.warn('Error in test_perceptron: Must have mode "Trigger" or "Argument"!' )
-            
+    for (feat_list_one_file, gold_list_one_file) in batches:
+        if feat_list_one_file is None:
+            continue    #no candidates in this file
         feature_list += feat_list_one_file
         gold_list += gold_list_one_file
+    return feature_list, gold_list
+
+
+# create predictions for test set. Test data is all data from files in file_list
+#data: a dataset.Dataset to predict instead of the candidates of file_list
+def test_perceptron(FV, Lambda, file_list, mode, subsample = False, n_jobs = 1, data = None):
+    if data is not None:
+        return predict_batch(data.to_csr(), Lambda).tolist(), data.labels.tolist()
+
+    feature_list, gold_list = build_data(FV, file_list, mode, n_jobs)
 
     if subsample:
         print '###################################'
@@ -124,27 +129,25 @@ def test_perceptron(FV, Lambda, file_list, mode, subsample = False):
         feature_list, gold_list = subsample(feature_list, gold_list, subsampling_rate = 0.8)    
         print 'Nones after subsampling', gold_list.count(u'None'), 'of',len(gold_list)
 
-    predictions = []    
-    gold_labels = []
-    for i, (f,y) in enumerate(zip(feature_list, gold_list) ):
-        if not i%100:
-            print 'Predicting', i, 'of', len(gold_list)
-        y_hat = predict(f, Lambda)
-        predictions += [y_hat]
-        if mode == 'Trigger':
-            gold_labels += [ FV.trigger_list.index(y) ]
-        elif mode == 'Argument':
-            gold_labels += [ [u'None', u'Theme', u'Cause'].index(y) ]   
-            
+    if mode == 'Trigger':
+        label_list = FV.trigger_list
+    elif mode == 'Argument':
+        label_list = FV.arguments_list
+    gold_labels = [ label_list.index(y) for y in gold_list ]
+
+    if not feature_list:
+        return [], gold_labels
+    print 'Predicting', len(gold_list), 'candidates'
+    predictions = predict_batch(vstack(feature_list, format = 'csr'), Lambda).tolist()
     return predictions, gold_labels
         
         
 #predict function for perceptron algorithm. Returns highest scoring class
 def predict(feature_matrix, Lambda, return_scores = False):
-    #feature matrix: rows - classes; columns - feature dimensions
-    scores = []
-    for c in range(feature_matrix.shape[0]):
-        scores.append( np.exp( feature_matrix.getrow(c).dot(Lambda[c,:])[0] ) )
+    #feature matrix: a single row of class-independent features. The score of
+    #class c is its dot product with row c of Lambda.
+    linear_scores = np.asarray(feature_matrix.dot(Lambda.T)).ravel()
+    scores = list(np.exp(linear_scores))
         
     highest_score = max(scores)
     predicted_class = scores.index(highest_score)
@@ -154,33 +157,175 @@ def predict(feature_matrix, Lambda, return_scores = False):
         return predicted_class
 
 
+#predict all candidates of a file or split at once. X: csr matrix with one row
+#of class-independent features per candidate. Returns the highest scoring class
+#of every row, and with return_scores also the (n_rows x n_classes) linear scores.
+def predict_batch(X, Lambda, return_scores = False):
+    scores = np.asarray(X.dot(Lambda.T))
+    predictions = scores.argmax(axis = 1)
+    if return_scores:
+        return predictions, scores
+    return predictions
+
+
+#highest scoring class of a binary row, given by its active feature ids
+def predict_active(active, Lambda):
+    return int(Lambda[:, active].sum(axis = 1).argmax())
+
+
+#perceptron update after a mistake, in place: only the columns of the active
+#features of X change, in the rows of the gold and of the predicted class.
+#X: csr row, or the array of active feature ids of a binary row.
+def update_weights(Lambda, X, y, y_hat, LR):
+    if isinstance(X, np.ndarray):
+        indices, step = X, LR
+    else:
+        X = X.tocsr()
+        indices, step = X.indices, LR * X.data.astype(Lambda.dtype)
+    Lambda[y_hat, indices] -= step
+    Lambda[y, indices] += step
+
+
 #call this for training perceptron, either in trigger or argument mode.
-def train_perceptron(FV, training_files, T_max = 1, LR = 1.0, mode = 'Trigger', subs_rate = 0.8):
+def train_perceptron(FV, training_files, T_max = 1, LR = 1.0, mode = 'Trigger', subs_rate = 0.8,
+                     n_jobs = 1, streaming = False, buffer_size = 1000, store = None,
+                     data = None, parallel = None, n_workers = None):
+    """
+    streaming: if True, don't build the whole training set up front but stream
+    it document by document in every epoch, see train_perceptron_streaming
+    (buffer_size is only used in streaming mode).
+    store: feature_store.FeatureStore to take the features from
+    data: dataset.Dataset to train on instead of the candidates of training_files
+    parallel: 'mixing' or 'hogwild' to train on n_workers processes (None: all
+    cores) with iterative parameter mixing or lock-free updates of shared
+    weights, see parallel_training.py
+    """
+    if streaming:
+        return train_perceptron_streaming(FV, training_files, T_max, LR, mode, subs_rate,
+                                          buffer_size, store)
+    if parallel is not None:
+        import parallel_training
+        return parallel_training.train_perceptron_parallel(FV, training_files, T_max, LR, 
+                                        mode, subs_rate, n_jobs, store, data, parallel, n_workers)
     t_start = time.time()
     N_files = len(training_files)
     
     #Generate training data
-    feature_list = []
-    gold_list = []
-    for i_f, filename in enumerate(training_files):
-        print 'Building training data from json file ',i_f
-        if mode == 'Trigger':
-            (feat_list_one_file, gold_list_one_file) = build_trigger_data_batch(filename, FV, clf='perc')
-        elif mode == 'Argument':
-            (feat_list_one_file, gold_list_one_file) = build_argument_data_batch(filename, FV, clf='perc')
+    data, rows = training_data(FV, training_files, mode, subs_rate, n_jobs, store, data)
+    N_classes = len(FV.trigger_list if mode == 'Trigger' else FV.arguments_list)
+    N_samples = len(rows)
+
+    #initialise parameters
+    Lambda = np.random.normal(0.0, 1.0, [N_classes, data.n_cols])    
+    iteration = 0
+    misclassification_rates = []
+    
+    #start training epochs
+    while iteration < T_max:
+        iteration+=1
+        misclassified = train_epoch(Lambda, data, rows, LR, iteration)
+        misclassification_rates += [ float(misclassified)/float(N_samples) ]
         
-        feature_list += feat_list_one_file
-        gold_list += gold_list_one_file
+    print time.time()-t_start, 'sec for', N_files, 'Files and', T_max, 'epochs.'
+    return Lambda, misclassification_rates
+
+
+# training Dataset of the candidates of training_files (or data, if given) and
+# the rows to train on, after subsampling the 'None' candidates.
+def training_data(FV, training_files, mode, subs_rate, n_jobs = 1, store = None, data = None):
+    if data is None:
+        data = dataset.load_dataset(FV, training_files, mode, n_jobs, store)
+    if mode == 'Trigger':
+        label_list = FV.trigger_list
+    elif mode == 'Argument':
+        label_list = FV.arguments_list
+    gold_list = [label_list[y] for y in data.labels]
     
     print 'Nones before subsampling', gold_list.count(u'None'), 'of', len(gold_list)
+    rows, gold_list = subsample(range(len(data)), gold_list, subsampling_rate = subs_rate)    
+    print 'Nones after subsampling', gold_list.count(u'None'), 'of',len(gold_list)
+    return data, rows
+
+
+# one perceptron epoch over the given rows of data, in that order. Lambda is
+# updated in place; returns the number of misclassified samples.
+def train_epoch(Lambda, data, rows, LR, iteration = 0):
+    N_samples = len(rows)
+    misclassified = 0
+    for sample in range(N_samples):
+        X = data.active(rows[sample])
+        y = data.labels[rows[sample]]
+        
+        y_hat = predict_active(X, Lambda)
+        if not sample % 50:
+            print 'it',iteration, sample, 'of', N_samples,'Predict:', y_hat, 'Gold:', y
+        if y_hat != y:
+            update_weights(Lambda, X, y, y_hat, LR)
+            misclassified +=1
+        else:
+            pass #prediction correct, no change.
+    return misclassified
+
+
+# (feature row, gold label id) of every candidate of one document. The features
+# come from the feature store if given (mode 'trigger'/'argument' blocks),
+# otherwise the document is featurized.
+def document_samples(FV, file_name, mode, store = None):
+    if store is not None:
+        block = store.block(file_name, 'trigger' if mode == 'Trigger' else 'argument')
+        X = block.to_csr()
+        return [(X.getrow(i), int(y)) for i, y in enumerate(block.labels)]
+
     if mode == 'Trigger':
-        feature_list, gold_list = subsample(feature_list, gold_list, subs_rate)    
+        feat_list, gold_list = build_trigger_data_batch(file_name, FV, clf='perc')
+        label_list = FV.trigger_list
     elif mode == 'Argument':
-        feature_list, gold_list = subsample(feature_list, gold_list, subsampling_rate = subs_rate)    
-    print 'Nones after subsampling', gold_list.count(u'None'), 'of',len(gold_list)
+        feat_list, gold_list = build_argument_data_batch(file_name, FV, clf='perc')
+        label_list = FV.arguments_list
+    if feat_list is None:
+        return []
+    return [(X, label_list.index(gold)) for X, gold in zip(feat_list, gold_list)]
 
-    N_classes, N_dims = feature_list[0].shape
-    N_samples = len(feature_list)
+
+# stream the samples of all files, one document at a time and in random file
+# order. 'None' samples are dropped on the fly with probability subs_rate, and
+# the samples are shuffled within a buffer of at most buffer_size samples.
+def stream_samples(FV, file_list, mode, subs_rate, buffer_size = 1000, store = None):
+    if mode == 'Trigger':
+        None_label = FV.trigger_list.index(u'None')
+    elif mode == 'Argument':
+        None_label = FV.arguments_list.index(u'None')
+    buffer = []
+    for i_f in np.random.permutation(len(file_list)):
+        for sample in document_samples(FV, file_list[i_f], mode, store):
+            if sample[1] == None_label and np.random.uniform() < subs_rate:
+                continue
+            if len(buffer) < buffer_size:
+                buffer.append(sample)
+            else:
+                #emit a random buffered sample and put the new one in its place
+                j = np.random.randint(buffer_size)
+                yield buffer[j]
+                buffer[j] = sample
+    for j in np.random.permutation(len(buffer)):
+        yield buffer[j]
+
+
+# out-of-core variant of train_perceptron: the training set is never held in
+# memory. In every epoch the files (or their cached feature store blocks, if a
+# feature_store.FeatureStore is given) are streamed through stream_samples, so
+# memory stays bounded by buffer_size samples plus one document.
+def train_perceptron_streaming(FV, training_files, T_max = 1, LR = 1.0, mode = 'Trigger', 
+                               subs_rate = 0.8, buffer_size = 1000, store = None):
+    t_start = time.time()
+    N_files = len(training_files)
+
+    if mode == 'Trigger':
+        N_classes = len(FV.trigger_list)
+        N_dims = FV.dim_trigger
+    elif mode == 'Argument':
+        N_classes = len(FV.arguments_list)
+        N_dims = FV.dim_argument
 
     #initialise parameters
     Lambda = np.random.normal(0.0, 1.0, [N_classes, N_dims])    
@@ -191,30 +336,18 @@ def train_perceptron(FV, training_files, T_max = 1, LR = 1.0, mode = 'Trigger',
     while iteration < T_max:
         iteration+=1
         misclassified = 0
+        N_samples = 0
 
-        for sample in range(N_samples):
-            X = feature_list[sample]
-            gold = gold_list[sample]
-            if mode == 'Trigger':
-                y = FV.trigger_list.index(gold)
-            elif mode == 'Argument':
-                y = [u'None', u'Theme', u'Cause'].index(gold)
-            
-            y_hat = predict(X, Lambda)
-            if not sample % 50:
-                print 'it',iteration, sample, 'of', N_samples,'Predict:', y_hat, 'Gold:', y
+        for X, y in stream_samples(FV, training_files, mode, subs_rate, buffer_size, store):
+            #linear scores, as predict_batch/predict_active in train_perceptron
+            y_hat = int(predict_batch(X, Lambda)[0])
+            if not N_samples % 50:
+                print 'it',iteration, N_samples, 'Predict:', y_hat, 'Gold:', y
+            N_samples += 1
             if y_hat != y:
-                Delta = np.zeros([N_classes, N_dims])
-                Delta[y_hat, :] = - LR * X.getrow(y_hat).todense() 
-                Delta[y , :]  =  LR * X.getrow(y).todense() 
-
-                Lambda_New = np.add(Lambda, Delta)
-                Lambda = Lambda_New
-                
+                update_weights(Lambda, X, y, y_hat, LR)
                 misclassified +=1
-            else:
-                pass #prediction correct, no change.
-        misclassification_rates += [ float(misclassified)/float(N_samples) ]
+        misclassification_rates += [ float(misclassified)/float(max(N_samples, 1)) ]
         
     print time.time()-t_start, 'sec for', N_files, 'Files and', T_max, 'epochs.'
     return Lambda, misclassification_rates
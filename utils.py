@@ -23,6 +23,12 @@ def precision(Confusion_matrix, None_label):
     denominator = np.sum(np.delete(Confusion_matrix, None_label, 1))
     precision = numerator/float(denominator)
     return precision    
+
+def recall(Confusion_matrix, None_label):
+    numerator = np.sum(Confusion_matrix.diagonal()) - Confusion_matrix[None_label,None_label]
+    denominator = np.sum(np.delete(Confusion_matrix, None_label, 0))
+    recall = numerator/float(denominator)
+    return recall
     
 # generic evaluation function for predictions.    
 def evaluate(y_gold, y_pred, FV, mode):
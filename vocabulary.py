@@ -0,0 +1,65 @@
+"""
+Frozen vocabulary: a fixed list of strings (feature values or labels) with a
+hash based string -> id map. It behaves like the plain python lists it
+replaces (len, indexing, iteration, 'in', .index()) but lookups are O(1).
+"""
+
+import io
+import json
+
+
+class Vocabulary(object):
+    def __init__(self, items):
+        #id -> string
+        self.items = tuple(items)
+        #string -> id. Like list.index(), a repeated entry maps to its first id.
+        self.ids = {}
+        for i, item in enumerate(self.items):
+            self.ids.setdefault(item, i)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.ids
+
+    def __eq__(self, other):
+        return isinstance(other, Vocabulary) and self.items == other.items
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Vocabulary(%d entries)' % len(self.items)
+
+    #dimension of the one-hot encoding over this vocabulary
+    @property
+    def dim(self):
+        return len(self.items)
+
+    #id of item, raises ValueError if unknown (same as list.index)
+    def index(self, item):
+        try:
+            return self.ids[item]
+        except KeyError:
+            raise ValueError('%r is not in vocabulary' % (item,))
+
+    #id of item, or default if unknown
+    def get(self, item, default = None):
+        return self.ids.get(item, default)
+
+    #stable on-disk form: utf-8 json list of the entries in id order
+    def save(self, file_name):
+        with io.open(file_name, 'w', encoding = 'utf-8') as f:
+            f.write(unicode(json.dumps(list(self.items), ensure_ascii = False)))
+
+    @classmethod
+    def load(cls, file_name):
+        with io.open(file_name, 'r', encoding = 'utf-8') as f:
+            return cls(json.load(f))